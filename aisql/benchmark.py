@@ -0,0 +1,255 @@
+import argparse
+import json
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import bot_engine
+import prompt_context
+import tennis_db
+from llm_clients import RecordingLlmClient, ReplayLlmClient
+
+# Text-to-SQL benchmark over the tennis db. Every question in
+# benchmark_questions.json has a gold query; a generated query counts as
+# correct when it returns the same set of rows (column order ignored).
+# Each answer is timed per stage (prompt build, LLM SQL call, SQL execution,
+# friendly-answer call) and the report gives accuracy and p50/p95 per strategy.
+#
+#   python benchmark.py                        # offline, gold-answering stub
+#   python benchmark.py --llm record           # live Gemini, saves a recording
+#   python benchmark.py --llm replay           # offline, replays the recording
+#   python benchmark.py --baseline old.json    # exit 1 on accuracy/latency regressions
+
+questionsPath = tennis_db.getPath("benchmark_questions.json")
+recordingPath = tennis_db.getPath("benchmark_recording.json")
+stages = ["promptBuild", "llmSql", "sqlExec", "llmFriendly", "total"]
+
+
+class GoldLlmClient:
+    # Offline stub that answers every SQL prompt with the gold query for the
+    # question it contains, so the harness and db side can be timed with no
+    # network. Accuracy is 100% by construction.
+    def __init__(self, cases):
+        self.model = "gold"
+        self.goldByQuestion = {case["question"]: case["gold"] for case in cases}
+
+    def generate(self, prompt, timeout=None):
+        if prompt.startswith("I asked a question"):
+            return "Here is your answer."
+        for question, gold in self.goldByQuestion.items():
+            if question in prompt:
+                return "```sqlite\n" + gold + "\n```"
+        raise KeyError("prompt does not contain a benchmark question")
+
+    def generateStream(self, prompt, timeout=None):
+        yield self.generate(prompt, timeout=timeout)
+
+
+def loadCases(path=questionsPath):
+    with open(path) as questionsFile:
+        return json.load(questionsFile)
+
+
+def normalizeRows(rows):
+    # order-insensitive over rows and columns, type-insensitive over values
+    return {tuple(sorted(str(value) for value in row)) for row in rows}
+
+
+def percentile(values, pct):
+    # nearest-rank percentile
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered)) - 1
+    return ordered[max(0, min(len(ordered) - 1, rank))]
+
+
+def runBenchmark(
+    llm,
+    strategies,
+    cases,
+    dbPath,
+    repeat=1,
+    maxWorkers=1,
+    callTimeout=None,
+    sqlTimeout=5.0,
+    maxRows=1000,
+    stream=False,
+):
+    connections = bot_engine.ReadOnlyConnections(dbPath, sqlTimeout, maxRows)
+    goldRows = [normalizeRows(connections.runSql(case["gold"]).rows) for case in cases]
+
+    def work(strategy, caseIndex, run):
+        case = cases[caseIndex]
+        captured = {}
+
+        def runAndCapture(query):
+            captured["result"] = connections.runSql(query)
+            return captured["result"]
+
+        result = bot_engine.answerQuestion(
+            llm,
+            strategies[strategy],
+            case["question"],
+            runAndCapture,
+            callTimeout,
+            stream=stream,
+        )
+        correct = (
+            result["error"] == "None"
+            and "result" in captured
+            and not captured["result"].truncated
+            and normalizeRows(captured["result"].rows) == goldRows[caseIndex]
+        )
+        timings = dict(result["timings"], total=result["seconds"])
+        return {
+            "strategy": strategy,
+            "question": case["question"],
+            "run": run,
+            "sql": result["sql"],
+            "correct": correct,
+            "error": result["error"],
+            "timings": timings,
+        }
+
+    try:
+        with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+            futures = [
+                pool.submit(work, strategy, caseIndex, run)
+                for run in range(repeat)
+                for strategy in strategies
+                for caseIndex in range(len(cases))
+            ]
+    finally:
+        connections.closeAll()
+    return [future.result() for future in futures]
+
+
+def aggregate(records):
+    summary = {}
+    for record in records:
+        summary.setdefault(record["strategy"], []).append(record)
+
+    for strategy, strategyRecords in summary.items():
+        row = {
+            "answers": len(strategyRecords),
+            "accuracy": sum(r["correct"] for r in strategyRecords) / len(strategyRecords),
+            "errors": sum(r["error"] != "None" for r in strategyRecords),
+        }
+        for stage in stages:
+            values = [r["timings"][stage] for r in strategyRecords]
+            row[f"{stage}P50"] = percentile(values, 50)
+            row[f"{stage}P95"] = percentile(values, 95)
+        summary[strategy] = row
+    return summary
+
+
+def printSummary(summary):
+    print("########################################################################")
+    header = f"{'strategy':<28}{'acc':>6}{'err':>5}"
+    for stage in stages:
+        header += f"{stage + ' p50/p95 ms':>26}"
+    print(header)
+    for strategy, row in summary.items():
+        line = f"{strategy:<28}{row['accuracy']:>6.0%}{row['errors']:>5}"
+        for stage in stages:
+            line += f"{row[stage + 'P50'] * 1000:>16.1f} /{row[stage + 'P95'] * 1000:>8.1f}"
+        print(line)
+
+
+def compareToBaseline(summary, baseline, tolerance, slack=0.005):
+    # accuracy must not drop; p95 total may grow by at most `tolerance`x
+    # (plus `slack` seconds, so sub-millisecond jitter on stub runs is ignored)
+    regressions = []
+    for strategy, row in summary.items():
+        old = baseline.get(strategy)
+        if old is None:
+            continue
+        if row["accuracy"] < old["accuracy"]:
+            regressions.append(
+                f"{strategy}: accuracy {old['accuracy']:.0%} -> {row['accuracy']:.0%}"
+            )
+        if row["totalP95"] > old["totalP95"] * tolerance + slack:
+            regressions.append(
+                f"{strategy}: p95 {old['totalP95'] * 1000:.1f} ms -> {row['totalP95'] * 1000:.1f} ms"
+            )
+    return regressions
+
+
+def makeLlm(mode, cases, recording, replayLatency):
+    if mode == "gold":
+        return GoldLlmClient(cases)
+    if mode == "replay":
+        return ReplayLlmClient(recording, replayLatency=replayLatency)
+
+    from llm_clients import GeminiClient
+
+    with open(tennis_db.getPath("config.json")) as configFile:
+        config = json.load(configFile)
+    return RecordingLlmClient(GeminiClient(config["openaiKey"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm", choices=["gold", "replay", "record"], default="gold")
+    parser.add_argument("--recording", default=recordingPath)
+    parser.add_argument("--replay-latency", action="store_true")
+    parser.add_argument("--questions", default=questionsPath)
+    parser.add_argument("--strategies", help="comma separated subset to run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stream", action="store_true", help="use streaming LLM calls")
+    parser.add_argument("--out", help="write the full report to this JSON file")
+    parser.add_argument("--baseline", help="report JSON from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    tennis_db.ensureDatabase()
+    cases = loadCases(args.questions)
+    llm = makeLlm(args.llm, cases, args.recording, args.replay_latency)
+
+    buildStart = perf_counter()
+    with open(tennis_db.setupSqlPath) as setupSqlFile, open(
+        tennis_db.setupSqlDataPath
+    ) as setupSqlDataFile:
+        strategies = prompt_context.buildStrategies(
+            tennis_db.sqliteDbPath,
+            setupSqlFile.read(),
+            setupSqlDataFile.read(),
+            bot_engine.commonSqlOnlyRequest,
+        )
+    print(f"Built {len(strategies)} strategy prefixes in {perf_counter() - buildStart:.3f}s")
+    if args.strategies:
+        strategies = {name: strategies[name] for name in args.strategies.split(",")}
+
+    records = runBenchmark(
+        llm,
+        strategies,
+        cases,
+        tennis_db.sqliteDbPath,
+        repeat=args.repeat,
+        maxWorkers=args.workers,
+        stream=args.stream,
+    )
+    summary = aggregate(records)
+    printSummary(summary)
+
+    if args.llm == "record":
+        llm.save(args.recording)
+        print(f"Saved recording to {args.recording}")
+
+    if args.out:
+        with open(args.out, "w") as outFile:
+            json.dump({"summary": summary, "records": records}, outFile, indent=2)
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as baselineFile:
+            regressions = compareToBaseline(
+                summary, json.load(baselineFile)["summary"], args.tolerance
+            )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,289 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from guarded_sql import GuardedExecutor, connectReadOnly
+from llm_clients import estimateTokens
+
+# Runs every (strategy, question) pair through the text-to-SQL flow on a
+# bounded thread pool. LLM calls dominate wall time and release the GIL while
+# waiting on the network, so threads are enough here.
+
+commonSqlOnlyRequest = " Give me a sqlite select statement that answers the question. Only respond with sqlite syntax. If there is an error do not explain it!"
+
+
+def sanitizeForJustSql(value):
+    gptStartSqlMarker = "```sqlite"
+    gptEndSqlMarker = "```"
+    if gptStartSqlMarker in value:
+        value = value.split(gptStartSqlMarker)[1]
+    if gptEndSqlMarker in value:
+        value = value.split(gptEndSqlMarker)[0]
+
+    return value
+
+
+def streamSql(chunks):
+    # Reads a completion chunk by chunk and returns the SQL as soon as the
+    # ```sqlite block is closed, closing the stream so the trailing chatter
+    # is never generated. Falls back to sanitizeForJustSql on the whole text
+    # when no complete block shows up.
+    gptStartSqlMarker = "```sqlite"
+    gptEndSqlMarker = "```"
+    text = ""
+    try:
+        for chunk in chunks:
+            text += chunk
+            start = text.find(gptStartSqlMarker)
+            if start == -1:
+                continue
+            end = text.find(gptEndSqlMarker, start + len(gptStartSqlMarker))
+            if end != -1:
+                return text[start + len(gptStartSqlMarker) : end]
+    finally:
+        chunks.close()
+    return sanitizeForJustSql(text)
+
+
+def buildSqlPrompt(promptPrefix, question):
+    return promptPrefix + " " + question + "\n" + commonSqlOnlyRequest
+
+
+def buildFriendlyPrompt(question, queryRawResponse):
+    return (
+        'I asked a question "'
+        + question
+        + '" and the response was "'
+        + queryRawResponse
+        + '" Please, just give a concise response in a more friendly way? Please do not give any other suggests or chatter.'
+    )
+
+
+class ReadOnlyConnections:
+    # One read-only SQLite connection (and guarded executor) per worker
+    # thread. sqlite3 objects must not be shared across threads, and mode=ro
+    # keeps generated SQL from writing to the db.
+    def __init__(self, dbPath, sqlTimeout=5.0, maxRows=1000, resultCache=None):
+        self.dbPath = dbPath
+        self.sqlTimeout = sqlTimeout
+        self.maxRows = maxRows
+        self.resultCache = resultCache
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.opened = []
+
+    def get(self):
+        executor = getattr(self.local, "executor", None)
+        if executor is None:
+            con = connectReadOnly(self.dbPath)
+            executor = GuardedExecutor(con, timeout=self.sqlTimeout, maxRows=self.maxRows)
+            self.local.executor = executor
+            with self.lock:
+                self.opened.append(con)
+        return executor
+
+    def runSql(self, query):
+        if self.resultCache is not None:
+            return self.resultCache.run(query, self.get().execute)
+        return self.get().execute(query)
+
+    def closeAll(self):
+        with self.lock:
+            for con in self.opened:
+                con.close()
+            self.opened = []
+
+
+def answerQuestion(
+    llm, promptPrefix, question, runSql, callTimeout=None, stream=False, onFriendlyChunk=None
+):
+    # With stream=True (client must have generateStream) the SQL is executed
+    # as soon as its code block is complete, and each friendly-answer chunk is
+    # passed to onFriendlyChunk as it arrives.
+    sqlSyntaxResponse = ""
+    queryRawResponse = ""
+    friendlyResponse = ""
+    queryStats = None
+    timeToFirstAnswer = None
+    error = "None"
+    # wall time per stage, so slow questions can be pinned on a stage
+    timings = {"promptBuild": 0.0, "llmSql": 0.0, "sqlExec": 0.0, "llmFriendly": 0.0}
+    start = perf_counter()
+    try:
+        stageStart = perf_counter()
+        sqlPrompt = buildSqlPrompt(promptPrefix, question)
+        timings["promptBuild"] = perf_counter() - stageStart
+
+        stageStart = perf_counter()
+        if stream:
+            sqlSyntaxResponse = streamSql(llm.generateStream(sqlPrompt, timeout=callTimeout))
+        else:
+            sqlSyntaxResponse = llm.generate(sqlPrompt, timeout=callTimeout)
+            sqlSyntaxResponse = sanitizeForJustSql(sqlSyntaxResponse)
+        timings["llmSql"] = perf_counter() - stageStart
+
+        stageStart = perf_counter()
+        queryResult = runSql(sqlSyntaxResponse)
+        queryStats = queryResult.stats()
+        queryRawResponse = str(queryResult.rows)
+        if queryResult.truncated:
+            queryRawResponse += f" (only the first {len(queryResult.rows)} rows)"
+        timings["sqlExec"] = perf_counter() - stageStart
+
+        stageStart = perf_counter()
+        friendlyPrompt = buildFriendlyPrompt(question, queryRawResponse)
+        if stream:
+            friendlyChunks = []
+            for chunk in llm.generateStream(friendlyPrompt, timeout=callTimeout):
+                if not friendlyChunks:
+                    timeToFirstAnswer = perf_counter() - start
+                friendlyChunks.append(chunk)
+                if onFriendlyChunk is not None:
+                    onFriendlyChunk(chunk)
+            friendlyResponse = "".join(friendlyChunks)
+        else:
+            friendlyResponse = llm.generate(friendlyPrompt, timeout=callTimeout)
+        timings["llmFriendly"] = perf_counter() - stageStart
+        if timeToFirstAnswer is None:
+            timeToFirstAnswer = perf_counter() - start
+    except Exception as err:
+        error = str(err) or type(err).__name__
+
+    return {
+        "question": question,
+        "sql": sqlSyntaxResponse,
+        "queryRawResponse": queryRawResponse,
+        "friendlyResponse": friendlyResponse,
+        "queryStats": queryStats,
+        "error": error,
+        "seconds": perf_counter() - start,
+        "timeToFirstAnswer": timeToFirstAnswer,
+        "timings": timings,
+    }
+
+
+printLock = threading.Lock()
+
+
+def printQuestionResult(strategy, result):
+    # one print per question so concurrent workers don't interleave lines
+    lines = [
+        "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~",
+        f"Strategy: {strategy}",
+        "Question:",
+        result["question"],
+        "SQL Syntax Response:",
+        result["sql"],
+        "Query Raw Response:",
+        result["queryRawResponse"],
+        "Friendly Response:",
+        result["friendlyResponse"],
+    ]
+    if result["error"] != "None":
+        lines.append(f"Error: {result['error']}")
+    with printLock:
+        print("\n".join(lines))
+
+
+def runStrategies(
+    llm,
+    strategies,
+    questions,
+    dbPath,
+    maxWorkers=4,
+    callTimeout=None,
+    sqlTimeout=5.0,
+    maxRows=1000,
+    resultCache=None,
+    stream=False,
+    verbose=True,
+):
+    # Returns one {"strategy", "prompt_prefix", "questionResults"} dict per
+    # strategy, in strategies order with questionResults in questions order,
+    # no matter which order the workers finish in.
+    connections = ReadOnlyConnections(dbPath, sqlTimeout, maxRows, resultCache)
+    # live friendly-answer output only makes sense with a single worker;
+    # otherwise chunks from different questions would interleave
+    echoStream = stream and verbose and maxWorkers == 1
+
+    def work(strategy, question):
+        onFriendlyChunk = None
+        if echoStream:
+            print(f"Streaming ({strategy}): {question}")
+
+            def onFriendlyChunk(chunk):
+                print(chunk, end="", flush=True)
+
+        result = answerQuestion(
+            llm,
+            strategies[strategy],
+            question,
+            connections.runSql,
+            callTimeout,
+            stream=stream,
+            onFriendlyChunk=onFriendlyChunk,
+        )
+        if echoStream:
+            print()
+        if verbose:
+            printQuestionResult(strategy, result)
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+            futures = {
+                strategy: [pool.submit(work, strategy, question) for question in questions]
+                for strategy in strategies
+            }
+    finally:
+        connections.closeAll()
+
+    return [
+        {
+            "strategy": strategy,
+            "prompt_prefix": strategies[strategy],
+            "questionResults": [future.result() for future in futures[strategy]],
+        }
+        for strategy in strategies
+    ]
+
+
+def summarizeStrategies(llm, allResponses):
+    # Prompt size and end-to-end latency per strategy, to weigh how cheap a
+    # prompt variant is against how often it answers correctly.
+    clientCount = getattr(llm, "countTokens", estimateTokens)
+
+    def countTokens(text):
+        # a failed count (network, quota) must not cost the run its results
+        try:
+            return clientCount(text)
+        except Exception as err:
+            print(f"countTokens failed ({err}); estimating instead")
+            return estimateTokens(text)
+
+    summary = []
+    for responses in allResponses:
+        seconds = sorted(result["seconds"] for result in responses["questionResults"])
+        summary.append(
+            {
+                "strategy": responses["strategy"],
+                "promptPrefixChars": len(responses["prompt_prefix"]),
+                "promptPrefixTokens": countTokens(responses["prompt_prefix"]),
+                "meanSeconds": sum(seconds) / len(seconds) if seconds else 0.0,
+                "maxSeconds": seconds[-1] if seconds else 0.0,
+                "errors": sum(
+                    result["error"] != "None" for result in responses["questionResults"]
+                ),
+            }
+        )
+    return summary
+
+
+def printStrategySummary(summary):
+    print("########################################################################")
+    print(f"{'strategy':<28}{'tokens':>9}{'mean s':>9}{'max s':>9}{'errors':>8}")
+    for row in summary:
+        print(
+            f"{row['strategy']:<28}{row['promptPrefixTokens']:>9}"
+            f"{row['meanSeconds']:>9.2f}{row['maxSeconds']:>9.2f}{row['errors']:>8}"
+        )
@@ -1,11 +1,16 @@
 import json
 
 # from openai import OpenAI
-from google import genai
 import os
-import sqlite3
 from time import time
 
+import bot_engine
+import prompt_context
+import tennis_db
+from llm_cache import CachingLlmClient, LlmResponseCache
+from llm_clients import GeminiClient
+from sql_cache import SqlResultCache
+
 print("Running db_bot.py!")
 
 fdir = os.path.dirname(__file__)
@@ -16,29 +21,41 @@ def getPath(fname):
 
 
 # SQLITE
-sqliteDbPath = getPath("aidb.sqlite")
-setupSqlPath = getPath("setup.sql")
-setupSqlDataPath = getPath("setupData.sql")
+sqliteDbPath = tennis_db.sqliteDbPath
+setupSqlPath = tennis_db.setupSqlPath
+setupSqlDataPath = tennis_db.setupSqlDataPath
 
-# Erase previous db
-if os.path.exists(sqliteDbPath):
-    os.remove(sqliteDbPath)
+# Reuse aidb.sqlite when setup.sql/setupData.sql are unchanged, rebuild
+# otherwise (set AIDB_REBUILD=1 to force a fresh build)
+dbFingerprint, dbBuilt = tennis_db.ensureDatabase(
+    sqliteDbPath, rebuild=os.environ.get("AIDB_REBUILD") == "1"
+)
+print(f"{'Built' if dbBuilt else 'Reusing'} {sqliteDbPath} ({dbFingerprint[:12]})")
 
-sqliteCon = sqlite3.connect(sqliteDbPath)  # create new db
-sqliteCursor = sqliteCon.cursor()
 with open(setupSqlPath) as setupSqlFile, open(setupSqlDataPath) as setupSqlDataFile:
     setupSqlScript = setupSqlFile.read()
     setupSQlDataScript = setupSqlDataFile.read()
 
-sqliteCursor.executescript(setupSqlScript)  # setup tables and keys
-sqliteCursor.executescript(setupSQlDataScript)  # setup tables and keys
-
-
-def runSql(query):
-    # print(f"\n\n\n\nin run sql\n{query}")
-    result = sqliteCursor.execute(query).fetchall()
-    # print(f"\n\n\n\n{result}\n\n\n\n")
-    return result
+# CONCURRENCY
+# question x strategy pairs run on this many threads, and each LLM call gives
+# up after llmCallTimeout seconds
+maxConcurrentQuestions = int(os.environ.get("AIDB_MAX_WORKERS", "4"))
+llmCallTimeout = float(os.environ.get("AIDB_LLM_TIMEOUT", "60"))
+
+# AIDB_STREAM=1 streams completions: SQL runs as soon as its code block is
+# closed, and with one worker the friendly answer is echoed as it arrives
+streamResponses = os.environ.get("AIDB_STREAM") == "1"
+
+# generated SQL is aborted after sqlTimeout seconds and cut off at sqlMaxRows
+sqlTimeout = float(os.environ.get("AIDB_SQL_TIMEOUT", "5"))
+sqlMaxRows = int(os.environ.get("AIDB_MAX_ROWS", "1000"))
+
+# identical SELECTs (after normalizing whitespace/case/comments) run once
+sqlResultCache = None
+if os.environ.get("AIDB_SQL_CACHE", "1") != "0":
+    sqlResultCache = SqlResultCache(
+        sqliteDbPath, maxEntries=int(os.environ.get("AIDB_SQL_CACHE_SIZE", "256"))
+    )
 
 
 # OPENAI
@@ -47,27 +64,29 @@ print(configPath)
 with open(configPath) as configFile:
     config = json.load(configFile)
 
-geminiClient = genai.Client(api_key=config["openaiKey"])
-geminiClient.models.list()  # check if the key is valid (update in config.json)
+geminiClient = GeminiClient(config["openaiKey"])
 
-
-def getGeminiResponse(content):
-    response = geminiClient.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=content,
+# Both the SQL and the friendly-answer calls go through an on-disk cache keyed
+# by model + prompt, so repeat runs skip the API (AIDB_LLM_CACHE=0 disables it)
+llmCache = None
+llmClient = geminiClient
+if os.environ.get("AIDB_LLM_CACHE", "1") != "0":
+    llmCache = LlmResponseCache(
+        getPath("llm_cache.sqlite"),
+        ttl=float(os.environ.get("AIDB_LLM_CACHE_TTL", 7 * 24 * 3600)),
     )
-
-    return response.text
+    llmClient = CachingLlmClient(geminiClient, llmCache)
 
 
 # strategies
-commonSqlOnlyRequest = " Give me a sqlite select statement that answers the question. Only respond with sqlite syntax. If there is an error do not explain it!"
-strategies = {
-    "zero_shot": setupSqlScript + setupSQlDataScript,
-    "single_domain_double_shot": (
-        setupSqlScript + setupSQlDataScript + commonSqlOnlyRequest
-    ),
-}
+commonSqlOnlyRequest = bot_engine.commonSqlOnlyRequest
+strategies = prompt_context.buildStrategies(
+    sqliteDbPath,
+    setupSqlScript,
+    setupSQlDataScript,
+    commonSqlOnlyRequest,
+    sampleRows=int(os.environ.get("AIDB_SAMPLE_ROWS", "3")),
+)
 
 questions = [
     "Who was ranked in the top 25 on September 1st?",
@@ -76,71 +95,39 @@ questions = [
 ]
 
 
-def sanitizeForJustSql(value):
-    gptStartSqlMarker = "```sqlite"
-    gptEndSqlMarker = "```"
-    if gptStartSqlMarker in value:
-        value = value.split(gptStartSqlMarker)[1]
-    if gptEndSqlMarker in value:
-        value = value.split(gptEndSqlMarker)[0]
-
-    return value
-
-
-for strategy in strategies:
-    responses = {"strategy": strategy, "prompt_prefix": strategies[strategy]}
-    questionResults = []
-    print("########################################################################")
-    print(f"Running strategy: {strategy}")
-    for question in questions:
-        print(
-            "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"
-        )
-        print("Question:")
-        print(question)
-        error = "None"
-        try:
-            getSqlFromQuestionEngineeredPrompt = (
-                strategies[strategy] + " " + question + "\n" + commonSqlOnlyRequest
-            )
-            sqlSyntaxResponse = getGeminiResponse(getSqlFromQuestionEngineeredPrompt)
-            sqlSyntaxResponse = sanitizeForJustSql(sqlSyntaxResponse)
-            print("SQL Syntax Response:")
-            print(sqlSyntaxResponse)
-            queryRawResponse = str(runSql(sqlSyntaxResponse))
-            print("Query Raw Response:")
-            print(queryRawResponse)
-            friendlyResultsPrompt = (
-                'I asked a question "'
-                + question
-                + '" and the response was "'
-                + queryRawResponse
-                + '" Please, just give a concise response in a more friendly way? Please do not give any other suggests or chatter.'
-            )
-            # betterFriendlyResultsPrompt = "I asked a question: \"" + question +"\" and I queried this database " + setupSqlScript + " with this query " + sqlSyntaxResponse + ". The query returned the results data: \""+queryRawResponse+"\". Could you concisely answer my question using the results data?"
-            friendlyResponse = getGeminiResponse(friendlyResultsPrompt)
-            print("Friendly Response:")
-            print(friendlyResponse)
-        except Exception as err:
-            error = str(err)
-            print(err)
-
-        questionResults.append(
-            {
-                "question": question,
-                "sql": sqlSyntaxResponse,
-                "queryRawResponse": queryRawResponse,
-                "friendlyResponse": friendlyResponse,
-                "error": error,
-            }
-        )
-
-    responses["questionResults"] = questionResults
-
-    with open(getPath(f"response_{strategy}_{time()}.json"), "w") as outFile:
+print("########################################################################")
+print(
+    f"Running {len(strategies)} strategies x {len(questions)} questions"
+    f" on {maxConcurrentQuestions} workers"
+)
+allResponses = bot_engine.runStrategies(
+    llmClient,
+    strategies,
+    questions,
+    sqliteDbPath,
+    maxWorkers=maxConcurrentQuestions,
+    callTimeout=llmCallTimeout,
+    sqlTimeout=sqlTimeout,
+    maxRows=sqlMaxRows,
+    resultCache=sqlResultCache,
+    stream=streamResponses,
+)
+
+strategySummary = bot_engine.summarizeStrategies(llmClient, allResponses)
+bot_engine.printStrategySummary(strategySummary)
+
+for responses, summary in zip(allResponses, strategySummary):
+    responses["summary"] = summary
+    with open(
+        getPath(f"response_{responses['strategy']}_{time()}.json"), "w"
+    ) as outFile:
         json.dump(responses, outFile, indent=2)
 
+if sqlResultCache is not None:
+    print(f"SQL result cache: {sqlResultCache.stats()}")
+
+if llmCache is not None:
+    print(f"LLM cache: {llmCache.stats()}")
+    llmCache.close()
 
-sqliteCursor.close()
-sqliteCon.close()
 print("Done!")
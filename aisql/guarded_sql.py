@@ -0,0 +1,97 @@
+import sqlite3
+from time import perf_counter
+
+# Runs model-generated SQL so a runaway query only hurts its own request:
+#   - read-only URI connection (mode=ro) plus PRAGMA query_only
+#   - wall-clock timeout enforced from a progress handler
+#   - rows streamed with fetchmany and capped at maxRows (truncated flag set)
+#   - per-query stats: rows, elapsed seconds, VM steps (counted in
+#     stepTick increments, i.e. rounded down to a multiple of 10 by default)
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class QueryResult:
+    def __init__(self, rows, truncated, elapsed, vmSteps, cached=False):
+        self.rows = rows
+        self.truncated = truncated
+        self.elapsed = elapsed
+        self.vmSteps = vmSteps
+        self.cached = cached
+
+    def stats(self):
+        return {
+            "rows": len(self.rows),
+            "truncated": self.truncated,
+            "elapsed": self.elapsed,
+            "vmSteps": self.vmSteps,
+            "cached": self.cached,
+        }
+
+
+def connectReadOnly(dbPath):
+    con = sqlite3.connect(f"file:{dbPath}?mode=ro", uri=True, check_same_thread=False)
+    con.execute("PRAGMA query_only = ON")
+    return con
+
+
+class GuardedExecutor:
+    # progressSteps is how many VM instructions run between deadline checks;
+    # smaller reacts faster to the deadline, larger costs less per query.
+    # The progress handler itself fires every stepTick instructions so the
+    # step count stays meaningful for small queries; a tick of 10 adds
+    # roughly a third to the runtime of cheap lookups, 1 would be ~4x.
+    def __init__(
+        self, con, timeout=5.0, maxRows=1000, fetchSize=200, progressSteps=1000, stepTick=10
+    ):
+        self.con = con
+        self.timeout = timeout
+        self.maxRows = maxRows
+        self.fetchSize = fetchSize
+        self.progressSteps = progressSteps
+        self.stepTick = stepTick
+
+    def execute(self, query):
+        start = perf_counter()
+        deadline = start + self.timeout if self.timeout else None
+        calls = [0]
+        checkEvery = max(1, self.progressSteps // self.stepTick)
+
+        def progress():
+            calls[0] += 1
+            if deadline is None or calls[0] % checkEvery:
+                return 0
+            # non-zero return makes sqlite abort with "interrupted"
+            return 1 if perf_counter() > deadline else 0
+
+        self.con.set_progress_handler(progress, self.stepTick)
+        cursor = self.con.cursor()
+        rows = []
+        truncated = False
+        try:
+            cursor.execute(query)
+            while True:
+                chunk = cursor.fetchmany(min(self.fetchSize, self.maxRows - len(rows) + 1))
+                if not chunk:
+                    break
+                rows.extend(chunk)
+                if len(rows) > self.maxRows:
+                    # one extra row tells us there was more without reading it all
+                    del rows[self.maxRows :]
+                    truncated = True
+                    break
+        except sqlite3.OperationalError as err:
+            if deadline is not None and perf_counter() > deadline:
+                raise QueryTimeout(
+                    f"query exceeded {self.timeout}s after ~{calls[0] * self.stepTick} VM steps"
+                ) from err
+            raise
+        finally:
+            cursor.close()
+            self.con.set_progress_handler(None, 0)
+
+        return QueryResult(
+            rows, truncated, perf_counter() - start, calls[0] * self.stepTick
+        )
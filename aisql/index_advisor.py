@@ -0,0 +1,327 @@
+import argparse
+import glob
+import json
+import re
+import sqlite3
+from time import perf_counter
+
+import tennis_db
+
+# Replays a workload through EXPLAIN QUERY PLAN: the SQL that db_bot.py
+# logged in response_*.json plus the gold queries in benchmark_questions.json.
+# Every full-table SCAN left over once setupIndexes.sql is loaded becomes a
+# candidate CREATE INDEX on the columns that query filters and joins that
+# table on (equality with a constant first, then other equality, then
+# ranges), followed by the other columns it reads so the index covers it.
+# Candidates that remove at least one SCAN are suggested, and the report
+# compares the plain schema against the schema with existing plus suggested
+# indexes.
+#
+#   python index_advisor.py                 # report only
+#   python index_advisor.py --apply         # add suggestions to setupIndexes.sql
+#                                           # and rebuild aidb.sqlite
+#   python index_advisor.py --json out.json
+
+responsesGlob = tennis_db.getPath("response_*.json")
+questionsPath = tennis_db.getPath("benchmark_questions.json")
+
+# widest index the advisor will suggest
+maxIndexColumns = 4
+
+stringLiteral = re.compile(r"'(?:[^']|'')*'")
+columnRef = re.compile(r"\b(?:(\w+)\.)?(\w+)\b")
+tableRef = re.compile(
+    r"\b(?:FROM|JOIN)\s+`?(\w+)`?(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|JOIN|LEFT|INNER"
+    r"|CROSS|GROUP|ORDER|LIMIT|UNION|USING|NATURAL)\b)(\w+))?",
+    re.IGNORECASE,
+)
+equalityAfter = re.compile(r"\s*(?:==?(?!=)|\bIN\b|\bIS\b)", re.IGNORECASE)
+literalAfter = re.compile(r"\s*(?:==?|\bIS\b)\s*(?:''|[-\d?:]|NULL\b)", re.IGNORECASE)
+rangeAfter = re.compile(r"\s*(?:<=|>=|<|>|\bBETWEEN\b|\bLIKE\b)", re.IGNORECASE)
+equalityBefore = re.compile(r"(?:[^<>!]=|\bIN\s*\()\s*$", re.IGNORECASE)
+rangeBefore = re.compile(r"(?:<=|>=|<|>)\s*$")
+
+
+def loadWorkload(pattern=responsesGlob):
+    # unique, non-empty SQL statements across all logged runs, in file order
+    queries = []
+    seen = set()
+    for responsePath in sorted(glob.glob(pattern)):
+        with open(responsePath) as responseFile:
+            try:
+                responses = json.load(responseFile)
+            except ValueError:
+                continue
+        for questionResult in responses.get("questionResults", []):
+            sql = (questionResult.get("sql") or "").strip()
+            if sql and sql not in seen:
+                seen.add(sql)
+                queries.append(sql)
+    return queries
+
+
+def loadGoldQueries(path=questionsPath):
+    # gold SQL from the benchmark, a workload that always matches the schema
+    try:
+        with open(path) as questionsFile:
+            cases = json.load(questionsFile)
+    except (OSError, ValueError):
+        return []
+    return [case["gold"].strip() for case in cases if case.get("gold")]
+
+
+def explain(con, sql):
+    # EXPLAIN QUERY PLAN detail column, one string per plan step
+    return [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + sql)]
+
+
+def scanSteps(plan):
+    # full scans only; "SCAN CONSTANT ROW" and covering index scans are cheap
+    return [
+        step
+        for step in plan
+        if step.startswith("SCAN ")
+        and "CONSTANT ROW" not in step
+        and "COVERING INDEX" not in step
+    ]
+
+
+def timeQuery(con, sql, repeat):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        con.execute(sql).fetchall()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def profileWorkload(con, queries, repeat):
+    profile = {}
+    for sql in queries:
+        try:
+            plan = explain(con, sql)
+            profile[sql] = {
+                "plan": plan,
+                "scans": scanSteps(plan),
+                "seconds": timeQuery(con, sql, repeat),
+            }
+        except sqlite3.Error as err:
+            profile[sql] = {"error": str(err)}
+    return profile
+
+
+def tableColumns(con):
+    # indexable columns per table; an INTEGER PRIMARY KEY is the rowid, which
+    # every index carries already
+    tables = [
+        row[0]
+        for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+            " AND name NOT LIKE 'sqlite_%'"
+        )
+    ]
+    columns = {}
+    for table in tables:
+        info = con.execute(f"PRAGMA table_info(`{table}`)").fetchall()
+        rowid = [row[1] for row in info if row[5]]
+        if len(rowid) != 1 or [row[2].upper() for row in info if row[5]] != ["INTEGER"]:
+            rowid = []
+        columns[table] = [row[1] for row in info if row[1] not in rowid]
+    return columns
+
+
+def candidateIndex(sql, alias, columns):
+    # (table, columns) for an index that would replace "SCAN alias", or None
+    sql = stringLiteral.sub("''", sql)
+    aliases = {}
+    for match in tableRef.finditer(sql):
+        aliases[match.group(2) or match.group(1)] = match.group(1)
+        aliases.setdefault(match.group(1), match.group(1))
+    table = aliases.get(alias)
+    if table not in columns:
+        return None  # a CTE or subquery
+
+    names = {alias, table}
+    constants, equality, ranges, reads = [], [], [], []
+    for match in columnRef.finditer(sql):
+        qualifier, column = match.groups()
+        if column not in columns[table] or (qualifier and qualifier not in names):
+            continue
+        before, after = sql[: match.start()], sql[match.end() :]
+        if literalAfter.match(after):
+            kind = constants
+        elif equalityAfter.match(after) or equalityBefore.search(before):
+            kind = equality
+        elif rangeAfter.match(after) or rangeBefore.search(before):
+            kind = ranges
+        else:
+            kind = reads
+        if column not in kind:
+            kind.append(column)
+
+    keys = []
+    for column in constants + equality + ranges + reads:
+        if column not in keys:
+            keys.append(column)
+    if not keys or len(keys) > maxIndexColumns or len(keys) == len(columns[table]):
+        return None  # nothing to key on, or the index would copy the table
+    return table, tuple(keys)
+
+
+def indexStatement(table, keys):
+    name = "idx_" + table + "_" + "_".join(keys)
+    cols = ", ".join(f"`{column}`" for column in keys)
+    return f"CREATE INDEX IF NOT EXISTS `{name}` ON `{table}` ({cols});"
+
+
+def scanCount(con, queries):
+    count = 0
+    for sql in queries:
+        try:
+            count += len(scanSteps(explain(con, sql)))
+        except sqlite3.Error:
+            pass
+    return count
+
+
+def suggestIndexes(con, queries):
+    # CREATE INDEX statements that each remove at least one SCAN from the
+    # workload on top of whatever indexes con already has
+    columns = tableColumns(con)
+    candidates = []
+    for sql in queries:
+        try:
+            steps = scanSteps(explain(con, sql))
+        except sqlite3.Error:
+            continue
+        for step in steps:
+            candidate = candidateIndex(sql, step.split()[1], columns)
+            if candidate and candidate not in candidates:
+                candidates.append(candidate)
+
+    suggestions = []
+    for table, keys in candidates:
+        baseline = scanCount(con, queries)
+        statement = indexStatement(table, keys)
+        con.execute(statement)
+        con.execute("ANALYZE")
+        if scanCount(con, queries) < baseline:
+            suggestions.append(statement)
+        else:
+            con.execute(f"DROP INDEX `{statement.split('`')[1]}`")
+    return suggestions
+
+
+def loadScripts(con, scriptPaths):
+    for path in scriptPaths:
+        with open(path) as scriptFile:
+            con.executescript(scriptFile.read())
+    con.execute("ANALYZE")
+
+
+def adviseIndexes(queries, repeat=20):
+    # build throwaway in-memory copies so the report never touches aidb.sqlite
+    con = sqlite3.connect(":memory:")
+    loadScripts(con, [tennis_db.setupSqlPath, tennis_db.setupSqlDataPath])
+    before = profileWorkload(con, queries, repeat)
+
+    loadScripts(con, [tennis_db.setupSqlIndexesPath])
+    suggestions = suggestIndexes(con, queries)
+    after = profileWorkload(con, queries, repeat)
+    con.close()
+
+    report = []
+    for sql in queries:
+        entry = {"sql": sql, "before": before[sql], "after": after[sql]}
+        if "error" not in before[sql] and "error" not in after[sql]:
+            entry["speedup"] = before[sql]["seconds"] / max(
+                after[sql]["seconds"], 1e-9
+            )
+        report.append(entry)
+    return report, suggestions
+
+
+def applySuggestions(suggestions, path=tennis_db.setupSqlIndexesPath):
+    # append the statements setupIndexes.sql doesn't have yet; returns them
+    with open(path) as indexFile:
+        existing = indexFile.read()
+    new = [statement for statement in suggestions if statement.split("`")[1] not in existing]
+    if new:
+        with open(path, "a") as indexFile:
+            indexFile.write("\n-- Suggested by index_advisor.py\n")
+            for statement in new:
+                indexFile.write("\n" + statement + "\n")
+    return new
+
+
+def hotTables(report, key):
+    # how many workload queries fully scan each table
+    counts = {}
+    for entry in report:
+        for step in entry[key].get("scans", []):
+            table = step.split()[1]
+            counts[table] = counts.get(table, 0) + 1
+    return counts
+
+
+def printReport(report, suggestions):
+    for entry in report:
+        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+        print(entry["sql"])
+        if "error" in entry["before"]:
+            print(f"  skipped: {entry['before']['error']}")
+            continue
+        for label in ("before", "after"):
+            result = entry[label]
+            print(f"  {label}: {result['seconds'] * 1000:.3f} ms")
+            for step in result["scans"]:
+                print(f"    SCAN step: {step}")
+        print(f"  speedup: {entry['speedup']:.2f}x")
+
+    valid = [entry for entry in report if "speedup" in entry]
+    print("####################################################################")
+    print(f"Queries profiled: {len(valid)} of {len(report)}")
+    if valid:
+        beforeTotal = sum(entry["before"]["seconds"] for entry in valid)
+        afterTotal = sum(entry["after"]["seconds"] for entry in valid)
+        print(f"Total before: {beforeTotal * 1000:.3f} ms")
+        print(f"Total after:  {afterTotal * 1000:.3f} ms")
+    print(f"Full scans by table/alias before: {hotTables(report, 'before')}")
+    print(f"Full scans by table/alias after:  {hotTables(report, 'after')}")
+    print(f"Suggested indexes: {len(suggestions)}")
+    for statement in suggestions:
+        print(f"  {statement}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--responses", default=responsesGlob)
+    parser.add_argument("--questions", default=questionsPath)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="add the suggested indexes to setupIndexes.sql and rebuild aidb.sqlite",
+    )
+    args = parser.parse_args()
+
+    workload = loadWorkload(args.responses)
+    print(f"Loaded {len(workload)} logged queries from {args.responses}")
+    gold = [sql for sql in loadGoldQueries(args.questions) if sql not in workload]
+    print(f"Loaded {len(gold)} gold queries from {args.questions}")
+    advisorReport, suggested = adviseIndexes(workload + gold, repeat=args.repeat)
+    printReport(advisorReport, suggested)
+
+    if args.json:
+        with open(args.json, "w") as outFile:
+            json.dump(
+                {"queries": advisorReport, "suggestions": suggested}, outFile, indent=2
+            )
+
+    if args.apply:
+        added = applySuggestions(suggested)
+        print(f"Added {len(added)} indexes to {tennis_db.setupSqlIndexesPath}")
+        fingerprint, built = tennis_db.ensureDatabase()
+        print(f"{'Rebuilt' if built else 'Already current'}: {fingerprint[:12]}")
@@ -0,0 +1,169 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+# Disk-backed LLM response cache. Entries are keyed by sha256(model + prompt),
+# expire after ttl seconds and are evicted least-recently-used first once the
+# cache holds more than maxEntries rows or maxBytes of response text.
+
+
+def promptKey(model, prompt):
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class LlmResponseCache:
+    def __init__(self, path, ttl=7 * 24 * 3600, maxEntries=10000, maxBytes=256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        # WAL + busy timeout so several bot processes can share one cache file
+        self.con = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode = WAL")
+        self.con.execute("PRAGMA synchronous = NORMAL")
+        self.con.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self.con.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)"
+        )
+        self.con.commit()
+
+    def get(self, model, prompt):
+        key = promptKey(model, prompt)
+        now = time.time()
+        with self.lock:
+            row = self.con.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                if row is not None:
+                    self.con.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.con.commit()
+                self.misses += 1
+                return None
+            self.con.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self.con.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model, prompt, response):
+        now = time.time()
+        with self.lock:
+            self.con.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (promptKey(model, prompt), model, response, len(response), now, now),
+            )
+            self.evict(now)
+            self.con.commit()
+
+    def evict(self, now):
+        # caller holds self.lock
+        cursor = self.con.cursor()
+        if self.ttl is not None:
+            cursor.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self.evictions += cursor.rowcount
+
+        count, size = cursor.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count <= self.maxEntries and size <= self.maxBytes:
+            return
+
+        # walk from least recently used, dropping rows until under both caps
+        doomed = []
+        for key, rowSize in cursor.execute(
+            "SELECT key, size FROM responses ORDER BY last_used"
+        ).fetchall():
+            if count <= self.maxEntries and size <= self.maxBytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            size -= rowSize
+        cursor.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            entries = self.con.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+            }
+
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+
+class CachingLlmClient:
+    # Wraps any llm_clients-style client; same generate(prompt, timeout) API.
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+        self.model = client.model
+
+    def generate(self, prompt, timeout=None):
+        cached = self.cache.get(self.model, prompt)
+        if cached is not None:
+            return cached
+        response = self.client.generate(prompt, timeout=timeout)
+        if response is not None:
+            self.cache.put(self.model, prompt, response)
+        return response
+
+    def generateStream(self, prompt, timeout=None):
+        cached = self.cache.get(self.model, prompt)
+        if cached is not None:
+            yield cached
+            return
+        # Cache what the caller read, whether it read to the end or closed
+        # the stream early (streamSql does once the SQL block is closed, and
+        # what it read is all it needs from this prompt). A stream that
+        # failed upstream raises out of the loop and is not cached.
+        stream = self.client.generateStream(prompt, timeout=timeout)
+        chunks = []
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            stream.close()
+            if chunks:
+                self.cache.put(self.model, prompt, "".join(chunks))
+            raise
+        self.cache.put(self.model, prompt, "".join(chunks))
+
+    def countTokens(self, text):
+        # token counts are API calls too (Gemini's count_tokens), so they are
+        # cached alongside responses under a separate model key
+        countModel = self.model + ":countTokens"
+        cached = self.cache.get(countModel, text)
+        if cached is not None:
+            return int(cached)
+        count = self.client.countTokens(text)
+        self.cache.put(countModel, text, str(count))
+        return count
@@ -0,0 +1,181 @@
+import json
+import threading
+import time
+
+from llm_cache import promptKey
+
+# Everything that talks to an LLM goes through an object with a
+# generate(prompt, timeout=None) -> str method, so db_bot.py and the engine
+# can run against Gemini or against a local fake with no network. Clients
+# that can stream also have generateStream(prompt, timeout=None), a generator
+# of text chunks; closing it early cancels the rest of the completion.
+
+defaultModel = "gemini-2.5-flash"
+
+
+def estimateTokens(text):
+    # rough chars-per-token ratio for English + SQL; good enough to compare
+    # prompt variants when the client can't count tokens itself
+    return (len(text) + 3) // 4
+
+
+class GeminiClient:
+    def __init__(self, apiKey, model=defaultModel, validate=True):
+        # imported here so the fakes work without google-genai installed
+        from google import genai
+
+        self.model = model
+        self.client = genai.Client(api_key=apiKey)
+        if validate:
+            self.client.models.list()  # check if the key is valid (update in config.json)
+
+    def requestConfig(self, timeout):
+        from google.genai import types
+
+        if timeout is None:
+            return None
+        return types.GenerateContentConfig(
+            http_options=types.HttpOptions(timeout=int(timeout * 1000))
+        )
+
+    def generate(self, prompt, timeout=None):
+        response = self.client.models.generate_content(
+            model=self.model,
+            contents=prompt,
+            config=self.requestConfig(timeout),
+        )
+        return response.text
+
+    def generateStream(self, prompt, timeout=None):
+        stream = self.client.models.generate_content_stream(
+            model=self.model,
+            contents=prompt,
+            config=self.requestConfig(timeout),
+        )
+        for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
+    def countTokens(self, text):
+        return self.client.models.count_tokens(
+            model=self.model, contents=text
+        ).total_tokens
+
+
+class FakeLlmClient:
+    # Answers from a function of the prompt (or a fixed string) after an
+    # optional simulated delay. Honors timeout like a real client would.
+    # generateStream hands the answer out chunkSize characters at a time,
+    # chunkDelay seconds apart, and counts how many chunks were consumed.
+    def __init__(
+        self,
+        responder="```sqlite\nSELECT 1;\n```",
+        delay=0.0,
+        model="fake",
+        chunkSize=16,
+        chunkDelay=0.0,
+    ):
+        self.responder = responder
+        self.delay = delay
+        self.model = model
+        self.chunkSize = chunkSize
+        self.chunkDelay = chunkDelay
+        self.prompts = []
+        self.chunksSent = 0
+
+    def generate(self, prompt, timeout=None):
+        self.prompts.append(prompt)
+        if timeout is not None and self.delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"fake LLM call exceeded {timeout}s")
+        if self.delay:
+            time.sleep(self.delay)
+        if callable(self.responder):
+            return self.responder(prompt)
+        return self.responder
+
+    def generateStream(self, prompt, timeout=None):
+        response = self.generate(prompt, timeout=timeout)
+        for offset in range(0, len(response), self.chunkSize):
+            if self.chunkDelay:
+                time.sleep(self.chunkDelay)
+            self.chunksSent += 1
+            yield response[offset : offset + self.chunkSize]
+
+    def countTokens(self, text):
+        return estimateTokens(text)
+
+
+class RecordingLlmClient:
+    # Passes calls through to a real client and keeps every response (and how
+    # long it took) so ReplayLlmClient can answer the same prompts offline.
+    def __init__(self, client):
+        self.client = client
+        self.model = client.model
+        self.recording = {}
+        self.lock = threading.Lock()
+
+    def generate(self, prompt, timeout=None):
+        start = time.perf_counter()
+        response = self.client.generate(prompt, timeout=timeout)
+        self.record(prompt, response, start)
+        return response
+
+    def generateStream(self, prompt, timeout=None):
+        # records what the caller read, also when it closed the stream early
+        # (see CachingLlmClient.generateStream)
+        start = time.perf_counter()
+        stream = self.client.generateStream(prompt, timeout=timeout)
+        chunks = []
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            stream.close()
+            if chunks:
+                self.record(prompt, "".join(chunks), start)
+            raise
+        self.record(prompt, "".join(chunks), start)
+
+    def record(self, prompt, response, start):
+        with self.lock:
+            self.recording[promptKey(self.model, prompt)] = {
+                "response": response,
+                "seconds": time.perf_counter() - start,
+            }
+
+    def countTokens(self, text):
+        return getattr(self.client, "countTokens", estimateTokens)(text)
+
+    def save(self, path):
+        with self.lock:
+            with open(path, "w") as outFile:
+                json.dump({"model": self.model, "responses": self.recording}, outFile, indent=2)
+
+
+class ReplayLlmClient:
+    # Answers from a RecordingLlmClient file. With replayLatency the recorded
+    # call time is slept as well, so stage timings look like the live run.
+    def __init__(self, path, replayLatency=False):
+        with open(path) as recordingFile:
+            recording = json.load(recordingFile)
+        self.model = recording["model"]
+        self.responses = recording["responses"]
+        self.replayLatency = replayLatency
+
+    def generate(self, prompt, timeout=None):
+        entry = self.responses.get(promptKey(self.model, prompt))
+        if entry is None:
+            raise KeyError("no recorded response for this prompt")
+        if self.replayLatency:
+            time.sleep(entry["seconds"] if timeout is None else min(entry["seconds"], timeout))
+            if timeout is not None and entry["seconds"] > timeout:
+                raise TimeoutError(f"recorded LLM call exceeded {timeout}s")
+        return entry["response"]
+
+    def generateStream(self, prompt, timeout=None):
+        yield self.generate(prompt, timeout=timeout)
+
+    def countTokens(self, text):
+        return estimateTokens(text)
@@ -0,0 +1,137 @@
+import re
+import sqlite3
+
+import tennis_db
+
+# Builds compact prompt prefixes by introspecting the live database instead of
+# pasting all of setupData.sql (~35 KB of INSERTs) into every prompt:
+#   schemaOnly       - CREATE TABLE statements
+#   schemaWithSample - DDL + the first few rows of each table as INSERTs
+#   schemaWithStats  - DDL + per-column row/distinct/null counts, min/max and
+#                      the full value list for low-cardinality text columns
+# Summary tables from setupSummaries.sql are ordinary tables, so they show up
+# in all three (with their explanatory comments) when they were built.
+
+dateValue = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def listTables(con):
+    # user tables in creation order, skipping sqlite_* and our _build_meta
+    return [
+        row[0]
+        for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+            " AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\'"
+            " ORDER BY rowid"
+        )
+    ]
+
+
+def listColumns(con, table):
+    return [row[1] for row in con.execute(f"PRAGMA table_info(`{table}`)")]
+
+
+def schemaOnly(con, tables=None):
+    statements = []
+    for table in tables or listTables(con):
+        sql = con.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()[0]
+        statements.append(sql + ";")
+    return "\n\n".join(statements) + "\n"
+
+
+def sqlLiteral(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def schemaWithSample(con, sampleRows=3):
+    parts = [schemaOnly(con)]
+    for table in listTables(con):
+        rows = con.execute(f"SELECT * FROM `{table}` LIMIT ?", (sampleRows,)).fetchall()
+        if rows:
+            values = ",".join(
+                "(" + ",".join(sqlLiteral(value) for value in row) + ")" for row in rows
+            )
+            parts.append(f"INSERT INTO `{table}` VALUES {values};")
+    return "\n".join(parts) + "\n"
+
+
+def columnStats(con, table, column, maxListedValues=12):
+    total, distinct, nulls, low, high = con.execute(
+        f"SELECT COUNT(*), COUNT(DISTINCT `{column}`), SUM(`{column}` IS NULL),"
+        f" MIN(`{column}`), MAX(`{column}`) FROM `{table}`"
+    ).fetchone()
+    stats = f"{column}: {distinct} distinct"
+    if nulls:
+        stats += f", {nulls} null"
+    if isinstance(low, str) and not dateValue.match(low):
+        if distinct <= maxListedValues:
+            values = [
+                row[0]
+                for row in con.execute(
+                    f"SELECT DISTINCT `{column}` FROM `{table}`"
+                    f" WHERE `{column}` IS NOT NULL ORDER BY 1"
+                )
+            ]
+            stats += ", values " + ", ".join(sqlLiteral(value) for value in values)
+    elif low is not None:
+        stats += f", min {sqlLiteral(low)}, max {sqlLiteral(high)}"
+    return stats
+
+
+def schemaWithStats(con, maxListedValues=12):
+    parts = [schemaOnly(con)]
+    for table in listTables(con):
+        rowCount = con.execute(f"SELECT COUNT(*) FROM `{table}`").fetchone()[0]
+        parts.append(f"-- {table}: {rowCount} rows")
+        for column in listColumns(con, table):
+            parts.append("--   " + columnStats(con, table, column, maxListedValues))
+    return "\n".join(parts) + "\n"
+
+
+def buildPromptContexts(dbPath, sampleRows=3):
+    # all compact variants at once, keyed by the strategy name db_bot uses
+    con = sqlite3.connect(f"file:{dbPath}?mode=ro", uri=True)
+    try:
+        return {
+            "schema_only": schemaOnly(con),
+            "schema_sample_rows": schemaWithSample(con, sampleRows),
+            "schema_column_stats": schemaWithStats(con),
+        }
+    finally:
+        con.close()
+
+
+def buildStrategies(dbPath, setupSqlScript, setupSqlDataScript, sqlOnlyRequest, sampleRows=3):
+    # the original full-dump strategies plus the compact variants above
+    strategies = {
+        "zero_shot": setupSqlScript + setupSqlDataScript,
+        "single_domain_double_shot": (
+            setupSqlScript + setupSqlDataScript + sqlOnlyRequest
+        ),
+    }
+    # the full-dump prefixes come from the setup files, so tell them about the
+    # precomputed summary tables separately
+    con = sqlite3.connect(f"file:{dbPath}?mode=ro", uri=True)
+    try:
+        present = [table for table in tennis_db.summaryTables if table in listTables(con)]
+        summaries = schemaOnly(con, present) if present else ""
+    finally:
+        con.close()
+    if summaries:
+        for name in strategies:
+            strategies[name] = (
+                setupSqlScript
+                + setupSqlDataScript
+                + "\n-- Precomputed summary tables, prefer these when they answer the question\n"
+                + summaries
+                + (sqlOnlyRequest if name == "single_domain_double_shot" else "")
+            )
+
+    strategies.update(buildPromptContexts(dbPath, sampleRows))
+    return strategies
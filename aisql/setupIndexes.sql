@@ -0,0 +1,21 @@
+-- Secondary indexes for the joins and filters the generated SQL leans on.
+-- Each one covers the columns those queries read, so SQLite can answer from
+-- the index without visiting the table. Run index_advisor.py after editing.
+
+CREATE INDEX IF NOT EXISTS `idx_matches_winner` ON `matches` (`winner_id`, `loser_id`, `tournament_edition_id`, `round`);
+
+CREATE INDEX IF NOT EXISTS `idx_matches_loser` ON `matches` (`loser_id`, `winner_id`, `tournament_edition_id`, `round`);
+
+CREATE INDEX IF NOT EXISTS `idx_matches_edition` ON `matches` (`tournament_edition_id`, `round`, `winner_id`, `loser_id`);
+
+CREATE INDEX IF NOT EXISTS `idx_rankings_date_rank` ON `rankings` (`ranking_date`, `rank`, `player_id`, `points`);
+
+CREATE INDEX IF NOT EXISTS `idx_rankings_rank` ON `rankings` (`rank`, `ranking_date`, `player_id`);
+
+-- Suggested by index_advisor.py
+
+CREATE INDEX IF NOT EXISTS `idx_players_first_name_last_name` ON `players` (`first_name`, `last_name`);
+
+CREATE INDEX IF NOT EXISTS `idx_tournaments_surface_name` ON `tournaments` (`surface`, `name`);
+
+CREATE INDEX IF NOT EXISTS `idx_players_country_code` ON `players` (`country_code`);
@@ -0,0 +1,111 @@
+-- Precomputed summary tables for the questions the bot gets most. They are
+-- rebuilt together with the rest of aidb.sqlite whenever setup.sql or
+-- setupData.sql change (see tennis_db.py), so they never go stale.
+
+CREATE TABLE IF NOT EXISTS `head_to_head` (
+  -- one row per pair of players who met; player_a_id < player_b_id
+  `player_a_id` INTEGER NOT NULL,
+  `player_b_id` INTEGER NOT NULL,
+  `player_a_name` TEXT NOT NULL,
+  `player_b_name` TEXT NOT NULL,
+  `matches_played` INTEGER NOT NULL,
+  `player_a_wins` INTEGER NOT NULL,
+  `player_b_wins` INTEGER NOT NULL,
+  PRIMARY KEY (`player_a_id`, `player_b_id`)
+);
+
+INSERT INTO `head_to_head`
+SELECT
+  pa.`id`,
+  pb.`id`,
+  pa.`first_name` || ' ' || pa.`last_name`,
+  pb.`first_name` || ' ' || pb.`last_name`,
+  COUNT(*),
+  SUM(m.`winner_id` = pa.`id`),
+  SUM(m.`winner_id` = pb.`id`)
+FROM `matches` m
+JOIN `players` pa ON pa.`id` = MIN(m.`winner_id`, m.`loser_id`)
+JOIN `players` pb ON pb.`id` = MAX(m.`winner_id`, m.`loser_id`)
+GROUP BY pa.`id`, pb.`id`;
+
+CREATE INDEX IF NOT EXISTS `idx_head_to_head_matches` ON `head_to_head` (`matches_played`);
+
+CREATE TABLE IF NOT EXISTS `player_edition_rounds` (
+  -- furthest round each player reached in each tournament edition;
+  -- furthest_round is 'Winner' for the player who won the final
+  `player_id` INTEGER NOT NULL,
+  `player_name` TEXT NOT NULL,
+  `tournament_edition_id` INTEGER NOT NULL,
+  `tournament_name` TEXT NOT NULL,
+  `year` INTEGER NOT NULL,
+  `furthest_round` TEXT NOT NULL,
+  -- 1 = R128 ... 7 = Final, 8 = Winner (Round Robin counts as 4)
+  `round_order` INTEGER NOT NULL,
+  PRIMARY KEY (`player_id`, `tournament_edition_id`)
+);
+
+INSERT INTO `player_edition_rounds`
+WITH `appearances` AS (
+  SELECT `winner_id` AS `player_id`, `tournament_edition_id`,
+    CASE WHEN `round` = 'Final' THEN 'Winner' ELSE `round` END AS `reached`
+  FROM `matches`
+  UNION ALL
+  SELECT `loser_id`, `tournament_edition_id`, `round`
+  FROM `matches`
+),
+`ordered` AS (
+  SELECT `player_id`, `tournament_edition_id`, `reached`,
+    CASE `reached`
+      WHEN 'R128' THEN 1 WHEN 'R64' THEN 2 WHEN 'R32' THEN 3
+      WHEN 'R16' THEN 4 WHEN 'Round Robin' THEN 4 WHEN 'Quarterfinal' THEN 5
+      WHEN 'Semifinal' THEN 6 WHEN 'Final' THEN 7 WHEN 'Winner' THEN 8
+      ELSE 0
+    END AS `round_order`
+  FROM `appearances`
+)
+SELECT
+  o.`player_id`,
+  p.`first_name` || ' ' || p.`last_name`,
+  o.`tournament_edition_id`,
+  t.`name`,
+  te.`year`,
+  o.`reached`,
+  MAX(o.`round_order`)
+FROM `ordered` o
+JOIN `players` p ON p.`id` = o.`player_id`
+JOIN `tournament_editions` te ON te.`id` = o.`tournament_edition_id`
+JOIN `tournaments` t ON t.`id` = te.`tournament_id`
+GROUP BY o.`player_id`, o.`tournament_edition_id`;
+
+CREATE TABLE IF NOT EXISTS `ranking_snapshots` (
+  -- a ranking is valid from ranking_date up to (not including)
+  -- next_ranking_date; next_ranking_date is NULL for the latest list. The
+  -- ranking on any calendar day D is
+  --   WHERE ranking_date <= D AND (next_ranking_date IS NULL OR D < next_ranking_date)
+  `ranking_date` TEXT NOT NULL,
+  `next_ranking_date` TEXT NULL,
+  `rank` INTEGER NOT NULL,
+  `player_id` INTEGER NOT NULL,
+  `player_name` TEXT NOT NULL,
+  `points` INTEGER NULL,
+  PRIMARY KEY (`ranking_date`, `rank`, `player_id`)
+);
+
+INSERT INTO `ranking_snapshots`
+WITH `dates` AS (
+  SELECT `ranking_date`,
+    LEAD(`ranking_date`) OVER (ORDER BY `ranking_date`) AS `next_ranking_date`
+  FROM (SELECT DISTINCT `ranking_date` FROM `rankings`)
+)
+SELECT
+  r.`ranking_date`,
+  d.`next_ranking_date`,
+  r.`rank`,
+  r.`player_id`,
+  p.`first_name` || ' ' || p.`last_name`,
+  r.`points`
+FROM `rankings` r
+JOIN `dates` d ON d.`ranking_date` = r.`ranking_date`
+JOIN `players` p ON p.`id` = r.`player_id`;
+
+CREATE INDEX IF NOT EXISTS `idx_ranking_snapshots_player` ON `ranking_snapshots` (`player_id`, `ranking_date`);
@@ -0,0 +1,106 @@
+import re
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+import tennis_db
+from guarded_sql import QueryResult
+
+# In-memory LRU of query results keyed on normalized SQL text, so SELECTs that
+# only differ in whitespace, comments, keyword case or a trailing semicolon
+# run once. Entries belong to one database fingerprint; when tennis_db
+# rebuilds aidb.sqlite the whole cache is dropped.
+
+sqlToken = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    |(?P<quoted>'(?:[^']|'')*'|"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+    |(?P<space>\s+)
+    |(?P<number>0[xX][0-9a-fA-F]+|(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+    |(?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    |(?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def normalizeSql(query):
+    # Unquoted words are upper-cased (SQLite keywords and bare identifiers are
+    # case-insensitive); string literals, quoted identifiers and numbers are
+    # kept as is, numbers as single tokens so "1e5" never matches "1 e5".
+    tokens = []
+    for match in sqlToken.finditer(query):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            continue
+        text = match.group()
+        tokens.append(text.upper() if kind == "word" else text)
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return " ".join(tokens)
+
+
+class SqlResultCache:
+    def __init__(self, dbPath=tennis_db.sqliteDbPath, maxEntries=256, recheckSeconds=5.0):
+        self.dbPath = dbPath
+        self.maxEntries = maxEntries
+        self.recheckSeconds = recheckSeconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.fingerprint = tennis_db.readFingerprint(dbPath)
+        self.checkedAt = monotonic()
+
+    def checkFingerprint(self):
+        # caller holds self.lock; re-reads the db fingerprint at most every
+        # recheckSeconds so the hot path stays a dict lookup
+        now = monotonic()
+        if now - self.checkedAt < self.recheckSeconds:
+            return
+        self.checkedAt = now
+        fingerprint = tennis_db.readFingerprint(self.dbPath)
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self.entries.clear()
+            self.invalidations += 1
+
+    def run(self, query, execute):
+        # execute(query) -> QueryResult is only called on a miss; errors and
+        # timeouts propagate and are not cached
+        key = normalizeSql(query)
+        with self.lock:
+            self.checkFingerprint()
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return QueryResult(
+                    cached.rows, cached.truncated, 0.0, 0, cached=True
+                )
+            self.misses += 1
+
+        result = execute(query)
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / total if total else 0.0,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+            }
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import sqlite3
+
+fdir = os.path.dirname(__file__)
+
+
+def getPath(fname):
+    return os.path.join(fdir, fname)
+
+
+sqliteDbPath = getPath("aidb.sqlite")
+setupSqlPath = getPath("setup.sql")
+setupSqlDataPath = getPath("setupData.sql")
+setupSqlIndexesPath = getPath("setupIndexes.sql")
+setupSqlSummariesPath = getPath("setupSummaries.sql")
+
+# Precomputed tables from setupSummaries.sql. They are on by default; set
+# AIDB_MATERIALIZE=0 to build the plain schema only.
+summaryTables = ["head_to_head", "player_edition_rounds", "ranking_snapshots"]
+materializeSummaries = os.environ.get("AIDB_MATERIALIZE", "1") != "0"
+
+# Every file that goes into the build. The fingerprint covers all of them, so
+# editing any one of these triggers a rebuild on the next start.
+buildScriptPaths = [setupSqlPath, setupSqlDataPath, setupSqlIndexesPath]
+if materializeSummaries:
+    buildScriptPaths.append(setupSqlSummariesPath)
+
+# Internal bookkeeping table. The leading underscore keeps it out of anything
+# that introspects the "real" tennis tables.
+metaTable = "_build_meta"
+
+
+def fingerprintScripts(scriptPaths=None):
+    # sha256 over file names and contents, in build order
+    digest = hashlib.sha256()
+    for path in scriptPaths or buildScriptPaths:
+        with open(path, "rb") as scriptFile:
+            digest.update(os.path.basename(path).encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(scriptFile.read())
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def readFingerprint(dbPath=sqliteDbPath):
+    # fingerprint recorded in an existing db, or None if missing/unreadable
+    if not os.path.exists(dbPath):
+        return None
+    try:
+        con = sqlite3.connect(f"file:{dbPath}?mode=ro", uri=True)
+        try:
+            row = con.execute(
+                f"SELECT value FROM {metaTable} WHERE key = 'fingerprint'"
+            ).fetchone()
+        finally:
+            con.close()
+    except sqlite3.DatabaseError:
+        return None
+    return row[0] if row else None
+
+
+def buildDatabase(dbPath=sqliteDbPath, scriptPaths=None, fingerprint=None):
+    scriptPaths = scriptPaths or buildScriptPaths
+    fingerprint = fingerprint or fingerprintScripts(scriptPaths)
+
+    # Build into a private temp file and swap it in at the end. Other bot
+    # processes either keep using the old file or see the finished new one,
+    # never a half-loaded db.
+    tmpPath = f"{dbPath}.{os.getpid()}.tmp"
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+
+    con = sqlite3.connect(tmpPath, isolation_level=None)
+    try:
+        # Bulk-load tuning: nothing reads the temp file until it is renamed
+        # and a failed build is simply deleted, so skip journaling and syncs.
+        con.execute("PRAGMA journal_mode = OFF")
+        con.execute("PRAGMA synchronous = OFF")
+        con.execute("PRAGMA temp_store = MEMORY")
+        con.execute("PRAGMA cache_size = -65536")
+        # setup.sql turns foreign keys on, but SQLite ignores that pragma
+        # inside the BEGIN below, so enable them before the script starts
+        con.execute("PRAGMA foreign_keys = ON")
+
+        script = ["BEGIN;"]
+        for path in scriptPaths:
+            with open(path) as scriptFile:
+                script.append(scriptFile.read())
+        script.append(
+            f"CREATE TABLE {metaTable} (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+        )
+        script.append(
+            f"INSERT INTO {metaTable} VALUES ('fingerprint', '{fingerprint}');"
+        )
+        script.append("COMMIT;")
+        con.executescript("\n".join(script))
+
+        con.execute("ANALYZE")
+        # Leave the finished file in rollback-journal mode: it is only ever
+        # read, and a WAL file would not survive the rename below.
+        con.execute("PRAGMA journal_mode = DELETE")
+    except BaseException:
+        con.close()
+        os.remove(tmpPath)
+        raise
+    con.close()
+
+    os.replace(tmpPath, dbPath)
+    return fingerprint
+
+
+def ensureDatabase(dbPath=sqliteDbPath, scriptPaths=None, rebuild=False):
+    # Reuse dbPath when its recorded fingerprint matches the build scripts,
+    # otherwise (re)build it. Returns (fingerprint, built).
+    fingerprint = fingerprintScripts(scriptPaths)
+    if not rebuild and readFingerprint(dbPath) == fingerprint:
+        return fingerprint, False
+    buildDatabase(dbPath, scriptPaths, fingerprint)
+    return fingerprint, True
@@ -0,0 +1,99 @@
+# import the necessary packages
+import threading
+import settings
+import metrics
+import time
+import math
+
+# Admission control for /predict. Before queueing an image the web server
+# asks whether the queue can still serve it within the SLO. If not, the
+# request is rejected at once with REJECT_STATUS and a Retry-After header,
+# instead of joining a queue it would time out in.
+#
+# The estimated wait is the number of images ahead of the request divided
+# by the rate the model servers drain the queue. That rate comes from the
+# traces on recent replies: each model worker's seconds per image (an EWMA
+# of model.predict time / batch size), summed over the workers seen in the
+# last WORKER_WINDOW seconds. The queue depth is re-read at most every
+# ADMISSION_CHECK_INTERVAL seconds, and admitted requests are added to it in
+# between, so a burst can't all slip in before the next check.
+
+# how long a model worker counts towards the drain rate after its last reply
+WORKER_WINDOW = 30.0
+
+ESTIMATED_WAIT = metrics.Gauge("web_estimated_queue_wait_seconds",
+	"Estimated queue wait for a new normal-priority image")
+
+def is_priority(upload_size, priority_header):
+	# small uploads and interactive clients take the priority lane
+	return settings.PRIORITY_LANE and (upload_size <= settings.PRIORITY_MAX_BYTES
+		or (priority_header or "").lower() == "interactive")
+
+class AdmissionController:
+	def __init__(self, max_depth=settings.MAX_QUEUE_DEPTH,
+		wait_slo=settings.QUEUE_WAIT_SLO,
+		check_interval=settings.ADMISSION_CHECK_INTERVAL, alpha=0.2):
+		self.max_depth = max_depth
+		self.wait_slo = wait_slo
+		self.check_interval = check_interval
+		self.alpha = alpha
+		self.lock = threading.Lock()
+
+		# (images ahead of a priority image, images ahead of a normal one)
+		self.depths = (0, 0)
+		self.checkedAt = -math.inf
+
+		# worker -> [EWMA seconds per image, when it last replied]
+		self.workers = {}
+
+	def stale(self):
+		return time.monotonic() - self.checkedAt >= self.check_interval
+
+	def update_depths(self, depths):
+		with self.lock:
+			self.depths = depths
+			self.checkedAt = time.monotonic()
+
+	def observe(self, trace):
+		# fold in the trace of a reply (see tracing.py)
+		if not trace or not trace.get("batch_size"):
+			return
+		cost = (trace["predict_end"] - trace["predict_start"]) / \
+			trace["batch_size"]
+		with self.lock:
+			worker = self.workers.get(trace["worker"])
+			if worker is None:
+				self.workers[trace["worker"]] = [cost, time.monotonic()]
+			else:
+				worker[0] = (1 - self.alpha) * worker[0] + self.alpha * cost
+				worker[1] = time.monotonic()
+
+	def drain_rate(self):
+		# images/s the live workers get through; caller holds self.lock
+		now = time.monotonic()
+		return sum(1.0 / cost for (cost, seen) in self.workers.values()
+			if now - seen <= WORKER_WINDOW and cost > 0)
+
+	def admit(self, priority=False):
+		# returns None to admit the request, or the seconds the client
+		# should wait before retrying
+		with self.lock:
+			depth = self.depths[0 if priority else 1]
+			rate = self.drain_rate()
+			wait = depth / rate if rate else 0.0
+			if not priority:
+				ESTIMATED_WAIT.set(wait)
+
+			if depth >= self.max_depth or wait > self.wait_slo:
+				# roughly when the queue will be back under both limits
+				allowed = min(self.max_depth, self.wait_slo * rate) \
+					if rate else self.max_depth
+				return max(1, math.ceil((depth - allowed) / rate)) \
+					if rate else 1
+
+			# count this request against the cached depth until the next
+			# refresh (a priority image is also ahead of every normal one)
+			(ahead, total) = self.depths
+			self.depths = (ahead + 1, total + 1) if priority else \
+				(ahead, total + 1)
+			return None
@@ -0,0 +1,137 @@
+# import the necessary packages
+import settings
+import time
+
+# Dynamic batching for the model server, in the spirit of Triton /
+# TF-Serving: once the first image of a batch is claimed, keep collecting
+# until either the target batch size is reached or MAX_BATCH_DELAY has
+# passed, whichever comes first. Light load gets small batches with little
+# added latency; bursts fill whole batches.
+#
+# The target batch size adapts to the model. After every batch the measured
+# model.predict time is folded into a per-image cost for that batch size
+# bucket (1, 2, 4, ... up to the max). The target becomes the smallest
+# bucket that is within BATCH_THROUGHPUT_SLACK of the best throughput seen,
+# provided its predicted latency fits BATCH_LATENCY_BUDGET. Now and then the
+# next bucket up is tried so better sizes get discovered.
+
+def size_buckets(max_batch_size):
+	buckets = [1]
+	while buckets[-1] < max_batch_size:
+		buckets.append(min(buckets[-1] * 2, max_batch_size))
+	return buckets
+
+def bucket_for(size, buckets):
+	for b in buckets:
+		if size <= b:
+			return b
+	return buckets[-1]
+
+class DynamicBatcher:
+	def __init__(self, wq, max_batch_size=settings.BATCH_SIZE,
+		max_delay=settings.MAX_BATCH_DELAY,
+		latency_budget=settings.BATCH_LATENCY_BUDGET, adaptive=True,
+		explore_every=50, alpha=0.2):
+		self.wq = wq
+		self.max_batch_size = max_batch_size
+		self.max_delay = max_delay
+		self.latency_budget = latency_budget
+		self.adaptive = adaptive
+		self.explore_every = explore_every
+		self.alpha = alpha
+		self.buckets = size_buckets(max_batch_size)
+		self.target = max_batch_size
+
+		# EWMA of model.predict seconds per image, keyed by bucket
+		self.per_image = {}
+
+		# running metrics
+		self.batches = 0
+		self.images = 0
+		self.queue_depth = 0
+		self.last_batch_size = 0
+		self.wait_seconds = 0.0
+		self.compute_seconds = 0.0
+
+	def next_batch(self, idle_timeout=settings.QUEUE_BLOCK_TIMEOUT):
+		# block (up to idle_timeout) for the first image, then keep
+		# claiming until the batch is full or max_delay has passed;
+		# returns the raw messages and how long the batch was held open
+		target = self.current_target()
+		batch = self.wq.claim_batch(target, idle_timeout)
+		if not batch:
+			return [], 0.0
+
+		opened = time.monotonic()
+		while len(batch) < target:
+			remaining = self.max_delay - (time.monotonic() - opened)
+			if remaining < 0.001:
+				break
+			more = self.wq.claim_batch(target - len(batch), remaining)
+			if not more:
+				break
+			batch.extend(more)
+
+		waited = time.monotonic() - opened
+		self.queue_depth = self.wq.depth()
+		self.wait_seconds += waited
+		return batch, waited
+
+	def record(self, batch_size, seconds):
+		# fold one model.predict measurement in and re-pick the target
+		bucket = bucket_for(batch_size, self.buckets)
+		cost = seconds / batch_size
+		old = self.per_image.get(bucket)
+		self.per_image[bucket] = cost if old is None else \
+			(1 - self.alpha) * old + self.alpha * cost
+
+		self.batches += 1
+		self.images += batch_size
+		self.last_batch_size = batch_size
+		self.compute_seconds += seconds
+
+		if self.adaptive:
+			self.target = self.choose_target()
+
+	def choose_target(self):
+		# smallest bucket within the throughput slack of the best one
+		# whose predicted batch latency fits the budget
+		fits = [b for b in self.buckets if b in self.per_image and
+			b * self.per_image[b] <= self.latency_budget]
+		if not fits:
+			return self.buckets[0] if self.per_image else self.max_batch_size
+		best = max(1.0 / self.per_image[b] for b in fits)
+		for b in fits:
+			if 1.0 / self.per_image[b] >= best * (1 - settings.BATCH_THROUGHPUT_SLACK):
+				return b
+		return fits[-1]
+
+	def current_target(self):
+		# try the next bucket above the target when there is a backlog
+		# it could fill and it hasn't been measured yet, and every
+		# explore_every batches anyway so its cost stays current
+		if not self.adaptive:
+			return self.target
+		larger = [b for b in self.buckets if b > self.target]
+		if not larger:
+			return self.target
+		if self.queue_depth > 0 and larger[0] not in self.per_image:
+			return larger[0]
+		if self.batches and self.batches % self.explore_every == 0:
+			return larger[0]
+		return self.target
+
+	def metrics(self):
+		batches = max(self.batches, 1)
+		return {
+			"queue_depth": self.queue_depth,
+			"target_batch_size": self.target,
+			"last_batch_size": self.last_batch_size,
+			"avg_batch_size": self.images / batches,
+			"avg_wait_ms": 1000 * self.wait_seconds / batches,
+			"avg_compute_ms": 1000 * self.compute_seconds / batches,
+			"batches": self.batches,
+			"images": self.images,
+			"per_image_ms": {b: 1000 * c for (b, c) in
+				sorted(self.per_image.items())},
+		}
@@ -0,0 +1,74 @@
+# USAGE
+# python bench_batch.py
+
+# Micro-benchmark for the model server's decode + batch assembly step. It
+# compares the original approach (decode each image, then grow the batch
+# with np.vstack) against decoding straight into a preallocated buffer, on
+# synthetic queue messages so neither Redis nor TensorFlow is needed.
+
+# import the necessary packages
+import numpy as np
+import settings
+import helpers
+import time
+import json
+
+# number of timed batches per approach
+ROUNDS = 20
+
+def make_messages(n, wire_dtype):
+	# build `n` queue messages the way the web server would
+	shape = (1, settings.IMAGE_HEIGHT, settings.IMAGE_WIDTH,
+		settings.IMAGE_CHANS)
+	messages = []
+	for i in range(n):
+		pixels = np.random.randint(0, 256, size=shape, dtype="uint8")
+		if wire_dtype == "json":
+			image = pixels.astype("float32")
+			d = {"id": str(i), "image": helpers.base64_encode_image(image)}
+			messages.append(json.dumps(d).encode("utf-8"))
+		else:
+			image = pixels if wire_dtype == "uint8" else pixels.astype("float32")
+			messages.append(helpers.encode_message(str(i), image,
+				preprocessed=wire_dtype != "uint8"))
+	return messages
+
+def vstack_batch(messages):
+	# the original loop: decode, then np.vstack onto the batch so far
+	batch = None
+	imageIDs = []
+	for q in messages:
+		header, image = helpers.decode_message(q)
+		image = image.reshape((1, settings.IMAGE_HEIGHT,
+			settings.IMAGE_WIDTH, settings.IMAGE_CHANS))
+		if not header.get("preprocessed", True):
+			image = helpers.preprocess_input_inplace(
+				image.astype(settings.IMAGE_DTYPE))
+		batch = image if batch is None else np.vstack([batch, image])
+		imageIDs.append(header["id"])
+	return imageIDs, batch
+
+def preallocated_batch(messages, out):
+	return helpers.assemble_batch(messages, out)
+
+def run(name, fn, messages):
+	fn(messages)
+	start = time.perf_counter()
+	for _ in range(ROUNDS):
+		fn(messages)
+	elapsed = time.perf_counter() - start
+	rate = ROUNDS * len(messages) / elapsed
+	print("{:<34} {:>9.1f} images/s  {:>7.2f} ms/batch".format(name, rate,
+		1000 * elapsed / ROUNDS))
+	return rate
+
+if __name__ == "__main__":
+	out = helpers.new_batch_buffer(settings.BATCH_SIZE)
+	for wire_dtype in ("json", "float32", "uint8"):
+		messages = make_messages(settings.BATCH_SIZE, wire_dtype)
+		print("[INFO] {} messages, {} bytes each".format(wire_dtype,
+			len(messages[0])))
+		before = run("  vstack", vstack_batch, messages)
+		after = run("  preallocated buffer",
+			lambda m: preallocated_batch(m, out), messages)
+		print("  speedup: {:.2f}x".format(after / before))
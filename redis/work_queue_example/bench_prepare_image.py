@@ -0,0 +1,100 @@
+# USAGE
+# python bench_prepare_image.py
+
+# Benchmark for the web server's image preparation. It compares the original
+# prepare_image (PIL resize -> img_to_array -> expand_dims ->
+# preprocess_input, then the copy predict() made) against the current
+# TensorFlow-free one, checks that both give identical arrays when JPEG
+# draft decoding is off, and reports the web server's import time and RSS.
+# Uses keras if it is installed and an equivalent NumPy reference if not.
+
+# import the necessary packages
+from PIL import Image
+import numpy as np
+import subprocess
+import settings
+import sys
+import time
+import helpers
+import io
+
+# number of timed calls per approach
+ROUNDS = 20
+
+try:
+	from tensorflow.keras.preprocessing.image import img_to_array
+	from keras.applications import imagenet_utils
+	preprocess_input = imagenet_utils.preprocess_input
+except ImportError:
+	def img_to_array(image):
+		return np.asarray(image, dtype="float32")
+
+	def preprocess_input(x):
+		# ResNet50's "caffe" mode: RGB -> BGR, subtract the ImageNet means
+		x = x[..., ::-1]
+		return x - np.array([103.939, 116.779, 123.68], dtype="float32")
+
+def legacy_prepare_image(image, target):
+	# the original function, plus the copy predict() used to make
+	if image.mode != "RGB":
+		image = image.convert("RGB")
+	image = image.resize(target)
+	image = img_to_array(image)
+	image = np.expand_dims(image, axis=0)
+	image = preprocess_input(image)
+	return image.copy(order="C")
+
+def current_prepare_image(image, target):
+	return helpers.prepare_image(image, target)
+
+def uploads():
+	# the sample images shipped with the example, plus a large photo-sized
+	# JPEG where draft decoding matters most
+	files = {}
+	for path in ["castle_image.jpg", "jemma.png"]:
+		with open(path, "rb") as f:
+			files[path] = f.read()
+
+	big = Image.fromarray(np.random.randint(0, 256, size=(3000, 4000, 3),
+		dtype="uint8")).resize((4000, 3000))
+	buf = io.BytesIO()
+	big.save(buf, format="JPEG", quality=90)
+	files["synthetic 4000x3000 jpeg"] = buf.getvalue()
+	return files
+
+def run(fn, data):
+	target = (settings.IMAGE_WIDTH, settings.IMAGE_HEIGHT)
+	out = fn(Image.open(io.BytesIO(data)), target)
+	start = time.perf_counter()
+	for _ in range(ROUNDS):
+		fn(Image.open(io.BytesIO(data)), target)
+	return out, (time.perf_counter() - start) / ROUNDS
+
+def startup():
+	# import time and peak RSS of a fresh process importing the web server
+	code = ("import time, resource; t = time.perf_counter(); "
+		"import run_web_server; "
+		"print(time.perf_counter() - t, "
+		"resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+	out = subprocess.run([sys.executable, "-c", code], capture_output=True,
+		text=True, check=True).stdout.split()
+	return float(out[0]), int(out[1]) / 1024
+
+for (name, data) in uploads().items():
+	print("[INFO] {} ({} KB)".format(name, len(data) // 1024))
+	legacy, legacyTime = run(legacy_prepare_image, data)
+
+	settings.JPEG_DRAFT = False
+	exact, exactTime = run(current_prepare_image, data)
+	settings.JPEG_DRAFT = True
+	draft, draftTime = run(current_prepare_image, data)
+
+	print("  {:<28}{:>8.2f} ms".format("original", legacyTime * 1000))
+	print("  {:<28}{:>8.2f} ms  identical: {}".format("numpy, no draft",
+		exactTime * 1000, np.array_equal(legacy, exact)))
+	print("  {:<28}{:>8.2f} ms  max abs diff: {:.1f}".format("numpy + draft",
+		draftTime * 1000, float(np.abs(legacy - draft).max())))
+
+seconds, rss = startup()
+print("[INFO] importing run_web_server: {:.2f} s, {:.0f} MB peak RSS".format(
+	seconds, rss))
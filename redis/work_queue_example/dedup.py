@@ -0,0 +1,198 @@
+# import the necessary packages
+from collections import OrderedDict
+import threading
+import settings
+import helpers
+import metrics
+import hashlib
+import asyncio
+import time
+
+# Prediction cache for /predict. Clients often upload the same image again
+# (simple_request.py and stress_test.py send one file every time), so each
+# web server keeps the predictions of recent uploads keyed by a hash of the
+# raw upload bytes. Hashing the bytes costs far less than decoding them, so
+# a hit skips decoding, the queue and the model server entirely; the price
+# is that a re-encoded copy of an image is a miss.
+#
+# Uploads of an image that is already being classified are coalesced: the
+# first request (the "leader") queues it, and the others wait for its
+# result instead of queueing copies. A waiter waits no longer than the
+# leader's own RESULT_TIMEOUT, and if the leader fails (rejected, timed out)
+# the waiters get the same failure rather than each queueing a copy; only
+# if the leader raises does one of them lead a retry.
+#
+# Entries live for CACHE_TTL seconds and the least recently used are
+# evicted once the cached predictions pass CACHE_MAX_BYTES.
+
+# rough bookkeeping cost of one entry on top of its key and output
+ENTRY_OVERHEAD = 200
+
+# time the leader may spend preparing and queueing the image on top of its
+# RESULT_TIMEOUT wait for the model server
+LEADER_GRACE = 1.0
+
+LOOKUPS = metrics.Counter("web_prediction_cache_total",
+	"/predict uploads by prediction cache result (hit, coalesced, miss)")
+CACHED_BYTES = metrics.Gauge("web_prediction_cache_bytes",
+	"Approximate size of the cached predictions")
+
+def content_key(data):
+	return hashlib.blake2b(data, digest_size=16).digest()
+
+def cached_result(output):
+	# a /predict result answered from the cache, in the (data, HTTP status,
+	# queued_at, trace, extra headers) form of the web servers'
+	# classify_upload
+	data = {"success": True,
+		"predictions": helpers.decode_output(output)[0]}
+	return data, 200, None, {}, {"X-Cache": "hit"}
+
+def coalesced_result(result):
+	# the leader's result as returned to a request that waited on it (None
+	# if the leader didn't finish in time)
+	if result is None:
+		return {"success": False,
+			"error": "timed out waiting for the model server"}, 504, None, \
+			{}, {}
+	(data, status, queuedAt, trace, headers) = result
+	if status == 200:
+		headers = {"X-Cache": "coalesced"}
+	return dict(data), status, None, {}, dict(headers)
+
+class PredictionCache:
+	def __init__(self, ttl=settings.CACHE_TTL,
+		max_bytes=settings.CACHE_MAX_BYTES):
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self.lock = threading.Lock()
+
+		# key -> (expires, output), least recently used first
+		self.entries = OrderedDict()
+		self.bytes = 0
+
+		# key -> (leader's deadline, callbacks waiting on its result)
+		self.inflight = {}
+
+	def get(self, key):
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				return None
+			if entry[0] <= time.monotonic():
+				self.remove(key)
+				return None
+			self.entries.move_to_end(key)
+			return entry[1]
+
+	def put(self, key, output):
+		size = len(key) + len(output) + ENTRY_OVERHEAD
+		if size > self.max_bytes:
+			return
+		with self.lock:
+			if key in self.entries:
+				self.remove(key)
+			self.entries[key] = (time.monotonic() + self.ttl, output)
+			self.bytes += size
+			while self.bytes > self.max_bytes:
+				self.remove(next(iter(self.entries)))
+		CACHED_BYTES.set(self.bytes)
+
+	def remove(self, key):
+		# caller holds self.lock
+		(expires, output) = self.entries.pop(key)
+		self.bytes -= len(key) + len(output) + ENTRY_OVERHEAD
+		CACHED_BYTES.set(self.bytes)
+
+	def join(self, key, notify):
+		# (leader, deadline): leader is True if the caller should classify
+		# the image (and then call finish); otherwise notify(result) is
+		# called when the leader does. deadline is when the leader's own
+		# wait for the model server runs out
+		with self.lock:
+			flight = self.inflight.get(key)
+			if flight is None:
+				deadline = time.monotonic() + settings.RESULT_TIMEOUT + \
+					LEADER_GRACE
+				self.inflight[key] = (deadline, [])
+				return True, deadline
+			flight[1].append(notify)
+			return False, flight[0]
+
+	def finish(self, key, result):
+		# the leader's classify_upload-style result (None if it raised):
+		# cache its predictions and hand it to everyone that joined in the
+		# meantime
+		with self.lock:
+			(deadline, waiters) = self.inflight.pop(key, (None, []))
+		if result is not None and result[1] == 200:
+			self.put(key, helpers.encode_output(result[0]["predictions"], {}))
+		for notify in waiters:
+			notify(result)
+
+	def lead(self, key, classify):
+		result = None
+		try:
+			result = classify()
+		finally:
+			self.finish(key, result)
+		return result
+
+	async def lead_async(self, key, classify):
+		result = None
+		try:
+			result = await classify()
+		finally:
+			self.finish(key, result)
+		return result
+
+	def classify(self, key, classify):
+		# the cached or coalesced result for `key`, else classify()'s
+		while True:
+			output = self.get(key)
+			if output is not None:
+				LOOKUPS.inc(result="hit")
+				return cached_result(output)
+
+			done = threading.Event()
+			shared = []
+			leader, deadline = self.join(key,
+				lambda result: (shared.append(result), done.set()))
+			if leader:
+				LOOKUPS.inc(result="miss")
+				return self.lead(key, classify)
+
+			# wait no longer than the leader itself will
+			done.wait(max(0, deadline - time.monotonic()))
+			if not shared or shared[0] is not None:
+				LOOKUPS.inc(result="coalesced")
+				return coalesced_result(shared[0] if shared else None)
+
+			# the leader raised instead of answering; go round again, and
+			# the first waiter back leads the retry
+
+	async def classify_async(self, key, classify):
+		# classify() for asyncio servers, where `classify` returns an
+		# awaitable; finish() then runs on the event loop's thread
+		while True:
+			output = self.get(key)
+			if output is not None:
+				LOOKUPS.inc(result="hit")
+				return cached_result(output)
+
+			future = asyncio.get_running_loop().create_future()
+			leader, deadline = self.join(key,
+				lambda result: future.done() or future.set_result(result))
+			if leader:
+				LOOKUPS.inc(result="miss")
+				return await self.lead_async(key, classify)
+
+			try:
+				result = await asyncio.wait_for(asyncio.shield(future),
+					max(0, deadline - time.monotonic()))
+			except asyncio.TimeoutError:
+				LOOKUPS.inc(result="coalesced")
+				return coalesced_result(None)
+			if result is not None:
+				LOOKUPS.inc(result="coalesced")
+				return coalesced_result(result)
@@ -0,0 +1,67 @@
+# USAGE
+# python fake_model_server.py
+
+# Stand-in for run_model_server.py that needs no TensorFlow. It claims,
+# batches and decodes images exactly like the real server (work_queue,
+# batching, helpers), but "predicts" by sleeping FAKE_BATCH_MS plus
+# FAKE_IMAGE_MS per image and answers every image with the same canned
+# predictions. Use it to load test the web server and queueing path on
+# their own (see load_test.py).
+
+# import the necessary packages
+import settings
+import helpers
+import transports
+import batching
+import time
+
+# simulated model.predict cost: fixed per batch plus per image (ms)
+FAKE_BATCH_MS = 20
+FAKE_IMAGE_MS = 2
+
+# what every image gets classified as
+CANNED_PREDICTIONS = [
+	{"label": "beagle", "probability": 0.9},
+	{"label": "Walker_hound", "probability": 0.05},
+	{"label": "English_foxhound", "probability": 0.02},
+	{"label": "basset", "probability": 0.01},
+	{"label": "bluetick", "probability": 0.01},
+]
+
+def fake_classify_process(wq, batch_ms=FAKE_BATCH_MS, image_ms=FAKE_IMAGE_MS,
+	stop=None, report=None):
+	# serve the image queue of transport `wq` until `stop` (a
+	# threading.Event) is set; `report` is called with the batching metrics
+	# every METRICS_LOG_INTERVAL seconds
+	wq.requeue_abandoned()
+	batchBuffer = helpers.new_batch_buffer(settings.BATCH_SIZE)
+	batcher = batching.DynamicBatcher(wq,
+		adaptive=settings.ADAPTIVE_BATCHING)
+	lastLog = time.monotonic()
+
+	while stop is None or not stop.is_set():
+		if report and time.monotonic() - lastLog >= settings.METRICS_LOG_INTERVAL:
+			report(batcher.metrics())
+			lastLog = time.monotonic()
+
+		queue, waited = batcher.next_batch(idle_timeout=1)
+		if not queue:
+			continue
+
+		claimedAt = time.time()
+		headers, batch = helpers.assemble_batch(queue, batchBuffer)
+		predictStart = time.time()
+		seconds = (batch_ms + image_ms * len(headers)) / 1000
+		time.sleep(seconds)
+		batcher.record(len(headers), seconds)
+
+		output = helpers.encode_output(CANNED_PREDICTIONS, {
+			"worker": wq.worker_id, "batch_size": len(headers),
+			"claimed_at": claimedAt, "predict_start": predictStart,
+			"predict_end": predictStart + seconds})
+		wq.publish_batch([(header["id"], output, header.get("reply_to"))
+			for header in headers])
+
+if __name__ == "__main__":
+	print("* Fake model server ready")
+	fake_classify_process(transports.open_model_transport())
@@ -1,6 +1,9 @@
 # import the necessary packages
 import numpy as np
+import settings
 import base64
+import struct
+import json
 import sys
 
 def base64_encode_image(a):
@@ -19,4 +22,154 @@ def base64_decode_image(a, dtype, shape):
 	a = a.reshape(shape)
 
 	# return the decoded image
-	return a
\ No newline at end of file
+	return a
+
+# Binary message envelope used on the image queue:
+#
+#   b"IMG1" | header length (uint32, little endian) | JSON header | raw array
+#
+# The header carries the image ID, dtype and shape (plus any extra fields,
+# e.g. whether the pixels were already preprocessed), and the array bytes
+# follow as-is, so the receiver can wrap them with np.frombuffer without
+# copying. Compared to base64 inside JSON this is a third smaller and skips
+# the b64/utf-8/json round trips on both sides.
+MESSAGE_MAGIC = b"IMG1"
+
+def message_header(image_id, a, **meta):
+	header = dict(meta, id=image_id, dtype=str(a.dtype), shape=list(a.shape))
+	return json.dumps(header).encode("utf-8")
+
+def encode_message(image_id, a, **meta):
+	# serialize an image ID + NumPy array (and extra header fields)
+	a = np.ascontiguousarray(a)
+	header = message_header(image_id, a, **meta)
+	return b"".join([MESSAGE_MAGIC, struct.pack("<I", len(header)), header,
+		memoryview(a).cast("B")])
+
+def encode_message_into(buf, image_id, a, **meta):
+	# same layout as encode_message, written straight into the writable
+	# buffer `buf` (e.g. a shared memory slot); returns the message length
+	header = message_header(image_id, a, **meta)
+	start = len(MESSAGE_MAGIC) + 4 + len(header)
+	if start + a.nbytes > len(buf):
+		raise ValueError("message of {} bytes does not fit a {} byte buffer"
+			.format(start + a.nbytes, len(buf)))
+
+	buf[:len(MESSAGE_MAGIC)] = MESSAGE_MAGIC
+	struct.pack_into("<I", buf, len(MESSAGE_MAGIC), len(header))
+	buf[len(MESSAGE_MAGIC) + 4:start] = header
+	np.frombuffer(buf, dtype=a.dtype, count=a.size,
+		offset=start).reshape(a.shape)[...] = a
+	return start + a.nbytes
+
+def decode_message(raw):
+	# return (header, image) for a queued message; the image is a
+	# read-only view over `raw`, not a copy
+	if raw[:len(MESSAGE_MAGIC)] == MESSAGE_MAGIC:
+		start = len(MESSAGE_MAGIC) + 4
+		(size,) = struct.unpack_from("<I", raw, len(MESSAGE_MAGIC))
+		header = json.loads(bytes(raw[start:start + size]))
+		a = np.frombuffer(raw, dtype=header["dtype"], offset=start + size)
+		return header, a.reshape(header["shape"])
+
+	# older web servers still send {"id", "image"} JSON with a base64
+	# float32 image that has already been preprocessed
+	q = json.loads(raw.decode("utf-8") if isinstance(raw, bytes) else raw)
+	shape = (1, settings.IMAGE_HEIGHT, settings.IMAGE_WIDTH,
+		settings.IMAGE_CHANS)
+	header = {"id": q["id"], "dtype": settings.IMAGE_DTYPE,
+		"shape": list(shape), "preprocessed": True}
+	return header, base64_decode_image(q["image"], settings.IMAGE_DTYPE, shape)
+
+def encode_output(predictions, trace):
+	# what the model server publishes for one image: its predictions plus
+	# the batch's trace timestamps (see tracing.py)
+	return json.dumps({"predictions": predictions, "trace": trace})
+
+def decode_output(output):
+	# (predictions, trace); bare prediction lists from older model servers
+	# come back with an empty trace
+	reply = json.loads(output)
+	if isinstance(reply, dict):
+		return reply["predictions"], reply.get("trace", {})
+	return reply, {}
+
+# per-channel ImageNet means (BGR order) used by ResNet50's "caffe" style
+# preprocess_input
+IMAGENET_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype="float32")
+
+def preprocess_input_inplace(a):
+	# same result as imagenet_utils.preprocess_input for ResNet50 (RGB ->
+	# BGR, subtract the ImageNet means) but written into `a` itself, which
+	# must be a float array with channels last
+	a[...] = a[..., ::-1]
+	a -= IMAGENET_MEAN_BGR
+	return a
+
+def preprocess_pixels_into(pixels, out):
+	# ImageNet preprocessing of 8-bit RGB `pixels` written straight into the
+	# float array `out`: convert, flip RGB -> BGR and subtract the mean in
+	# one pass per channel, with no intermediate float copy
+	for c in range(3):
+		np.subtract(pixels[..., 2 - c], IMAGENET_MEAN_BGR[c],
+			out=out[..., c], casting="unsafe")
+	return out
+
+def prepare_image(image, target, preprocess=True):
+	# web server side: resize a PIL upload to `target` and return it as a
+	# (1, H, W, 3) batch ready for the queue
+	# let the JPEG decoder scale down while decoding (by 1/2, 1/4 or 1/8,
+	# never below the target size) so there are far fewer pixels to decode
+	# and resize; a no-op for other formats
+	if settings.JPEG_DRAFT:
+		image.draft("RGB", target)
+
+	# if the image mode is not RGB, convert it
+	if image.mode != "RGB":
+		image = image.convert("RGB")
+
+	# resize the input image; without preprocessing, hand back the
+	# 8-bit pixels and let the model server do the rest
+	image = image.resize(target)
+	pixels = np.asarray(image, dtype="uint8")[np.newaxis]
+	if not preprocess:
+		return pixels
+
+	# otherwise convert and preprocess straight into one C-contiguous
+	# float array (the same result as img_to_array + preprocess_input,
+	# without TensorFlow or the intermediate copies)
+	out = np.empty(pixels.shape, dtype=settings.IMAGE_DTYPE)
+	return preprocess_pixels_into(pixels, out)
+
+def new_batch_buffer(batch_size=settings.BATCH_SIZE):
+	# one (BATCH_SIZE, H, W, C) array that every batch is decoded into
+	return np.empty((batch_size, settings.IMAGE_HEIGHT, settings.IMAGE_WIDTH,
+		settings.IMAGE_CHANS), dtype=settings.IMAGE_DTYPE)
+
+def decode_into(raw, row):
+	# decode one queued message into `row` (one slot of a batch buffer,
+	# uint8 pixels are converted by the assignment itself) and return its
+	# header (image ID plus any routing fields)
+	header, image = decode_message(raw)
+	image = image.reshape(row.shape)
+
+	# raw 8-bit pixels still need the ImageNet preprocessing the web
+	# server would otherwise have done
+	if header.get("preprocessed", True):
+		row[...] = image
+	else:
+		preprocess_pixels_into(image, row)
+	return header
+
+def assemble_batch(messages, out, pool=None):
+	# decode queued messages straight into rows of the preallocated `out`
+	# buffer and return their headers plus a view of the filled rows; with
+	# a thread `pool` the rows are decoded in parallel (NumPy releases the
+	# GIL for the per-channel conversions)
+	rows = [out[i] for i in range(len(messages))]
+	if pool is None or len(messages) < 2:
+		headers = [decode_into(raw, row) for (raw, row) in zip(messages, rows)]
+	else:
+		headers = list(pool.map(decode_into, messages, rows))
+
+	return headers, out[:len(headers)]
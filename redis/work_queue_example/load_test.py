@@ -0,0 +1,307 @@
+# USAGE
+# python load_test.py --local                        # everything in-process
+# python load_test.py --local --server async --mode open --rate 200
+# python load_test.py --local --transport shm
+# python load_test.py --url http://localhost:5000/predict --concurrency 64
+# python load_test.py --local --out new.json --baseline old.json
+
+# Load test for the /predict endpoint. Unlike stress_test.py it measures:
+# every request is timed, failures are counted by kind, and the report gives
+# p50/p95/p99 latency, a latency histogram and the achieved requests/s.
+#
+#   closed loop: --concurrency clients, each sending its next request as
+#                soon as the previous one returns
+#   open loop:   requests start at a fixed --rate regardless of how fast the
+#                server answers; latency is measured from each request's
+#                scheduled start, so a server that falls behind shows it
+#
+# With --local the web server (Flask or async), an in-memory fakeredis (or
+# the shared memory transport) and fake_model_server.py all run inside this
+# process, so the queueing path can be benchmarked, and regressions caught
+# with --baseline, with no Redis server or TensorFlow. Every request sends
+# the same image, so the web server's prediction cache is turned off there
+# unless --cache is given (it would answer all but the first from memory).
+
+# import the necessary packages
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import threading
+import argparse
+import logging
+import bisect
+import requests
+import tempfile
+import socket
+import time
+import json
+import math
+import sys
+import os
+
+# upper edges (ms) of the latency histogram buckets
+HISTOGRAM_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+	30000, math.inf]
+
+def percentile(values, pct):
+	# nearest-rank percentile
+	if not values:
+		return 0.0
+	ordered = sorted(values)
+	rank = math.ceil(pct / 100 * len(ordered)) - 1
+	return ordered[max(0, min(len(ordered) - 1, rank))]
+
+def make_session(pool_size):
+	# one session shared by every client thread, with enough pooled
+	# keep-alive connections that no request has to open its own
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	return session
+
+def call_predict_endpoint(session, url, image, timeout):
+	# returns None on success or a short description of the failure
+	try:
+		r = session.post(url, files={"image": image}, timeout=timeout)
+	except requests.Timeout:
+		return "timeout"
+	except requests.RequestException as e:
+		return type(e).__name__
+
+	if r.status_code != 200:
+		return "http {}".format(r.status_code)
+	if not r.json().get("success"):
+		return "success false"
+	return None
+
+class Recorder:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.latencies = []
+		self.errors = {}
+
+	def add(self, seconds, error):
+		with self.lock:
+			if error is None:
+				self.latencies.append(seconds)
+			else:
+				self.errors[error] = self.errors.get(error, 0) + 1
+
+def run_closed(url, image, concurrency, requests_total, duration, timeout):
+	recorder = Recorder()
+	session = make_session(concurrency)
+	counter = iter(range(requests_total or sys.maxsize))
+	counterLock = threading.Lock()
+	deadline = time.perf_counter() + duration if duration else math.inf
+
+	def client():
+		while time.perf_counter() < deadline:
+			with counterLock:
+				if next(counter, None) is None:
+					return
+			start = time.perf_counter()
+			error = call_predict_endpoint(session, url, image, timeout)
+			recorder.add(time.perf_counter() - start, error)
+
+	start = time.perf_counter()
+	threads = [threading.Thread(target=client) for _ in range(concurrency)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	return recorder, time.perf_counter() - start
+
+def run_open(url, image, rate, requests_total, duration, timeout,
+	max_in_flight):
+	recorder = Recorder()
+	session = make_session(max_in_flight)
+	total = requests_total or int(rate * duration)
+
+	def one(scheduled):
+		error = call_predict_endpoint(session, url, image, timeout)
+		recorder.add(time.perf_counter() - scheduled, error)
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_in_flight) as pool:
+		for i in range(total):
+			scheduled = start + i / rate
+			delay = scheduled - time.perf_counter()
+			if delay > 0:
+				time.sleep(delay)
+			pool.submit(one, scheduled)
+	return recorder, time.perf_counter() - start
+
+def report(recorder, elapsed, args):
+	latencies = recorder.latencies
+	ms = [s * 1000 for s in latencies]
+	labels = ["<= {} ms".format(edge) for edge in HISTOGRAM_MS[:-1]]
+	labels.append("> {} ms".format(HISTOGRAM_MS[-2]))
+	histogram = dict.fromkeys(labels, 0)
+	for value in ms:
+		histogram[labels[bisect.bisect_left(HISTOGRAM_MS, value)]] += 1
+
+	return {
+		"config": {k: v for (k, v) in vars(args).items()
+			if k not in ("out", "baseline")},
+		"requests": len(latencies) + sum(recorder.errors.values()),
+		"ok": len(latencies),
+		"errors": recorder.errors,
+		"seconds": elapsed,
+		"rps": len(latencies) / elapsed if elapsed else 0.0,
+		"latency_ms": {
+			"mean": sum(ms) / len(ms) if ms else 0.0,
+			"p50": percentile(ms, 50),
+			"p95": percentile(ms, 95),
+			"p99": percentile(ms, 99),
+			"max": max(ms) if ms else 0.0,
+		},
+		"histogram": histogram,
+	}
+
+def print_report(r):
+	print("[INFO] {} requests in {:.1f} s: {} ok, {:.1f} req/s".format(
+		r["requests"], r["seconds"], r["ok"], r["rps"]))
+	for (error, count) in sorted(r["errors"].items()):
+		print("[INFO]   {} x {}".format(count, error))
+	lat = r["latency_ms"]
+	print("[INFO] latency ms: mean {:.1f}  p50 {:.1f}  p95 {:.1f}  "
+		"p99 {:.1f}  max {:.1f}".format(lat["mean"], lat["p50"], lat["p95"],
+		lat["p99"], lat["max"]))
+	for (label, count) in r["histogram"].items():
+		if count:
+			print("  {:>12} {:>7}".format(label, count))
+
+def compare_to_baseline(r, baseline, tolerance):
+	# p95/p99 may grow by at most `tolerance`x, throughput may shrink by at
+	# most the same factor, and no new kinds of errors may appear
+	regressions = []
+	for key in ("p95", "p99"):
+		old, new = baseline["latency_ms"][key], r["latency_ms"][key]
+		if new > old * tolerance:
+			regressions.append("{} {:.1f} ms -> {:.1f} ms".format(key, old, new))
+	if r["rps"] < baseline["rps"] / tolerance:
+		regressions.append("rps {:.1f} -> {:.1f}".format(baseline["rps"],
+			r["rps"]))
+	if r["ok"] < r["requests"] and baseline["ok"] == baseline["requests"]:
+		regressions.append("errors: {}".format(r["errors"]))
+	return regressions
+
+def free_port():
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		return s.getsockname()[1]
+
+def start_local_stack(server, transport, batch_ms, image_ms, cache=False):
+	# web server + fake model server talking through an in-memory
+	# fakeredis, or through shared memory; returns the /predict URL
+	import fakeredis
+	import fake_model_server
+	import transports
+	import settings
+
+	settings.PREDICTION_CACHE = cache
+
+	redisServer = fakeredis.FakeServer()
+	if transport == "shm":
+		settings.SHM_SOCKET = os.path.join(tempfile.mkdtemp(), "load_test.sock")
+		wq = transports.ShmModelTransport(settings.SHM_SOCKET)
+	else:
+		wq = transports.RedisModelTransport(
+			fakeredis.FakeStrictRedis(server=redisServer))
+	threading.Thread(target=fake_model_server.fake_classify_process,
+		args=(wq, batch_ms, image_ms), daemon=True).start()
+
+	port = free_port()
+	if server == "flask":
+		from werkzeug.serving import make_server
+		import run_web_server
+		logging.getLogger("werkzeug").setLevel(logging.WARNING)
+		run_web_server.transport = transports.ShmWebTransport(
+			settings.SHM_SOCKET) if transport == "shm" else \
+			transports.RedisWebTransport(
+			fakeredis.FakeStrictRedis(server=redisServer))
+		httpd = make_server("127.0.0.1", port, run_web_server.app,
+			threaded=True)
+		threading.Thread(target=httpd.serve_forever, daemon=True).start()
+	else:
+		import run_async_web_server
+		import redis.asyncio
+		import uvicorn
+		run_async_web_server.connect = lambda: fakeredis.FakeAsyncRedis(
+			server=redisServer,
+			connection_pool_class=redis.asyncio.BlockingConnectionPool,
+			max_connections=settings.REDIS_MAX_CONNECTIONS, timeout=None)
+		run_async_web_server.db = run_async_web_server.connect()
+		httpd = uvicorn.Server(uvicorn.Config(run_async_web_server.app,
+			host="127.0.0.1", port=port, log_level="warning"))
+		threading.Thread(target=httpd.run, daemon=True).start()
+		while not httpd.started:
+			time.sleep(0.01)
+
+	return "http://127.0.0.1:{}/predict".format(port)
+
+if __name__ == "__main__":
+	ap = argparse.ArgumentParser()
+	ap.add_argument("--url", default="http://localhost:5000/predict")
+	ap.add_argument("--image", default="jemma.png")
+	ap.add_argument("--mode", choices=["closed", "open"], default="closed")
+	ap.add_argument("--concurrency", type=int, default=32,
+		help="closed loop: number of concurrent clients")
+	ap.add_argument("--rate", type=float, default=50,
+		help="open loop: requests started per second")
+	ap.add_argument("--max-in-flight", type=int, default=1000,
+		help="open loop: cap on outstanding requests")
+	ap.add_argument("--requests", type=int, default=500,
+		help="total requests (0 = run for --duration)")
+	ap.add_argument("--duration", type=float, default=30,
+		help="seconds to run when --requests is 0")
+	ap.add_argument("--timeout", type=float, default=60)
+	ap.add_argument("--warmup", type=int, default=10,
+		help="untimed requests sent first")
+	ap.add_argument("--local", action="store_true",
+		help="run the web server, fakeredis and a fake model server here")
+	ap.add_argument("--server", choices=["flask", "async"], default="flask")
+	ap.add_argument("--transport", choices=["redis", "shm"], default="redis",
+		help="with --local: fakeredis or shared memory (flask only)")
+	ap.add_argument("--fake-batch-ms", type=float, default=20)
+	ap.add_argument("--fake-image-ms", type=float, default=2)
+	ap.add_argument("--cache", action="store_true",
+		help="with --local: keep the prediction cache on (measures cache hits)")
+	ap.add_argument("--out", help="write the JSON report to this file")
+	ap.add_argument("--baseline", help="JSON report from an earlier run")
+	ap.add_argument("--tolerance", type=float, default=1.25)
+	args = ap.parse_args()
+
+	if args.server == "async" and args.transport == "shm":
+		ap.error("the async web server only supports the redis transport")
+	url = start_local_stack(args.server, args.transport, args.fake_batch_ms,
+		args.fake_image_ms, args.cache) if args.local else args.url
+	with open(args.image, "rb") as f:
+		image = f.read()
+
+	warmup = make_session(1)
+	for _ in range(args.warmup):
+		call_predict_endpoint(warmup, url, image, args.timeout)
+
+	duration = 0 if args.requests else args.duration
+	if args.mode == "closed":
+		recorder, elapsed = run_closed(url, image, args.concurrency,
+			args.requests, duration, args.timeout)
+	else:
+		recorder, elapsed = run_open(url, image, args.rate, args.requests,
+			duration, args.timeout, args.max_in_flight)
+
+	r = report(recorder, elapsed, args)
+	print_report(r)
+
+	if args.out:
+		with open(args.out, "w") as f:
+			json.dump(r, f, indent=2)
+
+	if args.baseline and os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			regressions = compare_to_baseline(r, json.load(f), args.tolerance)
+		for regression in regressions:
+			print("[REGRESSION] {}".format(regression))
+		if regressions:
+			sys.exit(1)
@@ -0,0 +1,139 @@
+# import the necessary packages
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import bisect
+import math
+
+# Minimal Prometheus-style metrics: counters, gauges and histograms kept in
+# process memory and rendered in the Prometheus text format for a /metrics
+# endpoint. Updating one is a lock plus an add (a bisect for histograms),
+# cheap enough to leave on in production. Every process has its own
+# registry, so scrape each web server and model server process.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# default histogram buckets for durations (seconds)
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+	1, 2.5, 5, 10, 30)
+
+class Registry:
+	def __init__(self):
+		self.metrics = []
+		self.lock = threading.Lock()
+
+	def register(self, metric):
+		with self.lock:
+			self.metrics.append(metric)
+		return metric
+
+	def render(self):
+		with self.lock:
+			metrics = list(self.metrics)
+		lines = []
+		for metric in metrics:
+			lines.append("# HELP {} {}".format(metric.name, metric.help))
+			lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+			lines.extend(metric.samples())
+		return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def format_labels(labels, extra=()):
+	pairs = list(labels) + list(extra)
+	if not pairs:
+		return ""
+	return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"'))
+		for (k, v) in pairs) + "}"
+
+def format_value(value):
+	if value == math.inf:
+		return "+Inf"
+	return repr(float(value))
+
+class Counter:
+	kind = "counter"
+
+	def __init__(self, name, help, registry=REGISTRY):
+		self.name = name
+		self.help = help
+		self.lock = threading.Lock()
+		self.values = {}
+		registry.register(self)
+
+	def inc(self, amount=1, **labels):
+		key = tuple(sorted(labels.items()))
+		with self.lock:
+			self.values[key] = self.values.get(key, 0) + amount
+
+	def samples(self):
+		with self.lock:
+			values = dict(self.values)
+		return ["{}{} {}".format(self.name, format_labels(key),
+			format_value(value)) for (key, value) in sorted(values.items())]
+
+class Gauge(Counter):
+	kind = "gauge"
+
+	def set(self, value, **labels):
+		key = tuple(sorted(labels.items()))
+		with self.lock:
+			self.values[key] = value
+
+	def dec(self, amount=1, **labels):
+		self.inc(-amount, **labels)
+
+class Histogram:
+	kind = "histogram"
+
+	def __init__(self, name, help, buckets=TIME_BUCKETS, registry=REGISTRY):
+		self.name = name
+		self.help = help
+		self.buckets = list(buckets)
+		if self.buckets[-1] != math.inf:
+			self.buckets.append(math.inf)
+		self.lock = threading.Lock()
+		self.counts = [0] * len(self.buckets)
+		self.sum = 0.0
+		registry.register(self)
+
+	def observe(self, value):
+		i = bisect.bisect_left(self.buckets, value)
+		with self.lock:
+			self.counts[i] += 1
+			self.sum += value
+
+	def samples(self):
+		with self.lock:
+			counts = list(self.counts)
+			total = self.sum
+		lines = []
+		cumulative = 0
+		for (edge, count) in zip(self.buckets, counts):
+			cumulative += count
+			lines.append("{}_bucket{} {}".format(self.name,
+				format_labels((), [("le", format_value(edge))]), cumulative))
+		lines.append("{}_sum {}".format(self.name, format_value(total)))
+		lines.append("{}_count {}".format(self.name, cumulative))
+		return lines
+
+def serve(port, registry=REGISTRY, host=""):
+	# expose `registry` at http://host:port/metrics from a daemon thread
+	class Handler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			if self.path.split("?")[0] != "/metrics":
+				self.send_error(404)
+				return
+			body = registry.render().encode("utf-8")
+			self.send_response(200)
+			self.send_header("Content-Type", CONTENT_TYPE)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer((host, port), Handler)
+	server.daemon_threads = True
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
@@ -0,0 +1,220 @@
+# USAGE
+# python model_supervisor.py --workers 4                 # 4 workers, cores split evenly
+# python model_supervisor.py --workers 2 --intra-op 8 --duration 120 --json 2x8.json
+# python model_supervisor.py --workers 4 --fake          # no TensorFlow
+
+# Runs several model servers (run_model_server.classify_process) side by
+# side on one machine. Each worker is its own process with its own ResNet50,
+# pinned to a slice of the CPUs with TensorFlow's intra-op/inter-op thread
+# pools sized to match, so workers don't fight over cores. They share the
+# Redis image queue through their own processing lists.
+#
+# A worker that dies is restarted under the same worker ID, and the new
+# process starts by putting the dead one's claimed images back on the
+# queue. Every --report-every seconds the supervisor prints each worker's
+# throughput, so different workers x threads layouts can be compared on a
+# given box (--duration and --json make that scriptable).
+
+# import the necessary packages
+from queue import Empty
+import multiprocessing
+import argparse
+import socket
+import settings
+import json
+import time
+import os
+
+def plan_layout(workers, cpus):
+	# split the CPUs into `workers` equal contiguous slices (cores are
+	# shared round-robin if there are more workers than cores)
+	cpus = sorted(cpus)
+	per = max(1, len(cpus) // workers)
+	return [[cpus[(i * per + j) % len(cpus)] for j in range(per)]
+		for i in range(workers)]
+
+def run_worker(index, worker_id, cpus, intra_op, inter_op, report_every,
+	stats, fake):
+	# runs in the child process, before TensorFlow is imported
+	if cpus and hasattr(os, "sched_setaffinity"):
+		os.sched_setaffinity(0, cpus)
+	os.environ["OMP_NUM_THREADS"] = str(intra_op)
+	settings.TF_INTRA_OP_THREADS = intra_op
+	settings.TF_INTER_OP_THREADS = inter_op
+	settings.METRICS_LOG_INTERVAL = report_every
+	if settings.MODEL_METRICS_PORT:
+		settings.MODEL_METRICS_PORT += index
+
+	def report(metrics):
+		stats.put((index, os.getpid(), time.time(), metrics))
+
+	if fake:
+		import fake_model_server
+		import transports
+		fake_model_server.fake_classify_process(
+			transports.open_model_transport(worker_id), report=report)
+	else:
+		import run_model_server
+		run_model_server.classify_process(worker_id, report)
+
+class Worker:
+	def __init__(self, index, worker_id, cpus):
+		self.index = index
+		self.worker_id = worker_id
+		self.cpus = cpus
+		self.process = None
+		self.restarts = 0
+		self.started = 0.0
+		self.first = None
+		self.last = None
+
+	def throughput(self):
+		# images/s between the first and latest report of this process
+		if self.first is None or self.last[0] <= self.first[0]:
+			return 0.0
+		return (self.last[1] - self.first[1]) / (self.last[0] - self.first[0])
+
+class Supervisor:
+	def __init__(self, workers, intra_op, inter_op, cpus, report_every,
+		restart_delay, fake, name=None):
+		if settings.TRANSPORT == "shm" and workers > 1:
+			raise ValueError("the shm transport supports one model worker")
+
+		self.ctx = multiprocessing.get_context("spawn")
+		self.stats = self.ctx.Queue()
+		self.intra_op = intra_op
+		self.inter_op = inter_op
+		self.report_every = report_every
+		self.restart_delay = restart_delay
+		self.fake = fake
+
+		# worker IDs are stable across worker and supervisor restarts so a
+		# replacement process finds its predecessor's processing list; two
+		# supervisors on one host need different names
+		name = name or socket.gethostname()
+		self.workers = [Worker(i, "{}:worker{}".format(name, i), c)
+			for (i, c) in enumerate(plan_layout(workers, cpus))]
+
+	def start(self, worker):
+		intra_op = self.intra_op or len(worker.cpus)
+		worker.process = self.ctx.Process(target=run_worker,
+			args=(worker.index, worker.worker_id, worker.cpus, intra_op,
+			self.inter_op, self.report_every, self.stats, self.fake),
+			daemon=True)
+		worker.process.start()
+		worker.started = time.monotonic()
+		worker.first = worker.last = None
+		print("* Worker {} (pid {}) on CPUs {}, {} intra-op threads".format(
+			worker.index, worker.process.pid, worker.cpus, intra_op))
+
+	def check(self):
+		# restart dead workers, at most once per restart_delay each
+		for w in self.workers:
+			if w.process.is_alive():
+				continue
+			if time.monotonic() - w.started < self.restart_delay:
+				continue
+			print("* Worker {} exited with code {}, restarting".format(
+				w.index, w.process.exitcode))
+			w.restarts += 1
+			self.start(w)
+
+	def collect(self, timeout):
+		# fold in worker reports until `timeout` seconds have passed
+		deadline = time.monotonic() + timeout
+		while True:
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				return
+			try:
+				(index, pid, at, metrics) = self.stats.get(timeout=remaining)
+			except Empty:
+				return
+
+			w = self.workers[index]
+			if w.process is None or w.process.pid != pid:
+				continue
+			w.last = (at, metrics["images"], metrics)
+			if w.first is None:
+				w.first = w.last
+
+	def summary(self):
+		rows = []
+		for w in self.workers:
+			metrics = w.last[2] if w.last else {}
+			rows.append({
+				"worker": w.index,
+				"cpus": w.cpus,
+				"restarts": w.restarts,
+				"images_per_sec": w.throughput(),
+				"avg_batch_size": metrics.get("avg_batch_size", 0.0),
+				"avg_compute_ms": metrics.get("avg_compute_ms", 0.0),
+				"images": metrics.get("images", 0),
+			})
+		return rows
+
+	def print_summary(self):
+		rows = self.summary()
+		print("* {:>6} {:>12} {:>8} {:>10} {:>10} {:>12}".format("worker",
+			"cpus", "restarts", "img/s", "avg batch", "compute ms"))
+		for r in rows:
+			print("* {:>6} {:>12} {:>8} {:>10.1f} {:>10.1f} {:>12.1f}".format(
+				r["worker"], "{}-{}".format(r["cpus"][0], r["cpus"][-1]),
+				r["restarts"], r["images_per_sec"], r["avg_batch_size"],
+				r["avg_compute_ms"]))
+		print("* total {:.1f} img/s".format(
+			sum(r["images_per_sec"] for r in rows)))
+
+	def run(self, duration=None):
+		for w in self.workers:
+			self.start(w)
+
+		began = time.monotonic()
+		try:
+			while duration is None or time.monotonic() - began < duration:
+				self.collect(self.report_every)
+				self.check()
+				self.print_summary()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			for w in self.workers:
+				w.process.terminate()
+			for w in self.workers:
+				w.process.join()
+
+		return self.summary()
+
+if __name__ == "__main__":
+	cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") \
+		else list(range(os.cpu_count()))
+
+	ap = argparse.ArgumentParser()
+	ap.add_argument("--workers", type=int, default=settings.MODEL_WORKERS)
+	ap.add_argument("--intra-op", type=int, default=0,
+		help="TF intra-op threads per worker (0 = its share of the CPUs)")
+	ap.add_argument("--inter-op", type=int, default=1)
+	ap.add_argument("--cpus", default=",".join(map(str, cpus)),
+		help="comma separated CPUs to spread the workers over")
+	ap.add_argument("--report-every", type=float, default=10)
+	ap.add_argument("--restart-delay", type=float, default=5,
+		help="minimum seconds between restarts of one worker")
+	ap.add_argument("--duration", type=float,
+		help="stop after this many seconds (default: run forever)")
+	ap.add_argument("--json", help="write the final per-worker summary here")
+	ap.add_argument("--name", help="worker ID prefix (default: hostname)")
+	ap.add_argument("--fake", action="store_true",
+		help="run fake_model_server workers instead of ResNet50")
+	args = ap.parse_args()
+
+	supervisor = Supervisor(args.workers, args.intra_op, args.inter_op,
+		[int(c) for c in args.cpus.split(",")], args.report_every,
+		args.restart_delay, args.fake, args.name)
+	rows = supervisor.run(args.duration)
+
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump({"workers": args.workers, "intra_op": args.intra_op,
+				"inter_op": args.inter_op, "per_worker": rows,
+				"images_per_sec": sum(r["images_per_sec"] for r in rows)},
+				f, indent=2)
@@ -0,0 +1,216 @@
+# USAGE
+# python run_async_web_server.py
+# (or: uvicorn run_async_web_server:app --port 5000)
+
+# import the necessary packages
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from PIL import Image
+import redis.asyncio
+import settings
+import helpers
+import work_queue
+import admission
+import dedup
+import tracing
+import metrics
+import asyncio
+import uvicorn
+import uuid
+import time
+import io
+
+# asyncio variant of run_web_server.py with the same "/" and "/predict"
+# JSON contract. A waiting request is just a future in `pending`, not a
+# blocked thread, so thousands of requests can be in flight in one process.
+#
+# Every queued image names this process's reply list in its "reply_to"
+# header; one background task BLPOPs that list and resolves the matching
+# future, so the whole process needs a single blocked Redis connection
+# instead of one per request. Decoding and prepare_image run on a small
+# thread pool so they don't stall the event loop.
+
+def connect():
+	# requests queue up for one of at most REDIS_MAX_CONNECTIONS pooled
+	# connections instead of opening one each (hosted Redis plans cap the
+	# number of clients)
+	pool = redis.asyncio.BlockingConnectionPool(host=settings.REDIS_HOST,
+		port=settings.REDIS_PORT, password=settings.REDIS_PASSWORD,
+		db=settings.REDIS_DB, max_connections=settings.REDIS_MAX_CONNECTIONS,
+		timeout=None)
+	return redis.asyncio.StrictRedis(connection_pool=pool)
+
+db = connect()
+replyTo = "{}:replies:{}".format(settings.IMAGE_QUEUE,
+	work_queue.process_id())
+executor = ThreadPoolExecutor(settings.PREPARE_THREADS)
+controller = admission.AdmissionController()
+cache = dedup.PredictionCache()
+pending = {}
+
+def load_image(data):
+	# runs on the executor: decode the upload and prepare it for the queue
+	preprocess = settings.IMAGE_WIRE_DTYPE != "uint8"
+	image = Image.open(io.BytesIO(data))
+	image = helpers.prepare_image(image,
+		(settings.IMAGE_WIDTH, settings.IMAGE_HEIGHT),
+		preprocess=preprocess)
+	return image, preprocess
+
+async def admit(priority):
+	# None if the image may be queued, else the Retry-After seconds
+	if not settings.ADMISSION_CONTROL:
+		return None
+	if controller.stale():
+		pipe = db.pipeline(transaction=False)
+		work_queue.read_depths(pipe)
+		controller.update_depths(work_queue.queue_depths(await pipe.execute()))
+	return controller.admit(priority)
+
+async def dispatch_replies():
+	# hand every reply that lands on our list to the request waiting on
+	# it; replies for requests that already timed out are dropped
+	replies = connect()
+	backoff = 0.1
+	while True:
+		try:
+			reply = await replies.blpop(replyTo,
+				timeout=settings.QUEUE_BLOCK_TIMEOUT)
+		except Exception as e:
+			# without this task every request would time out, so log the
+			# error, back off and reconnect (replies stay queued on the
+			# list meanwhile)
+			print("* Reply dispatcher error, reconnecting in {:.1f} s: {}".format(
+				backoff, e))
+			await asyncio.sleep(backoff)
+			backoff = min(2 * backoff, settings.QUEUE_BLOCK_TIMEOUT)
+			try:
+				await replies.aclose()
+			except Exception:
+				pass
+			replies = connect()
+			continue
+		backoff = 0.1
+		if reply is None:
+			continue
+
+		try:
+			imageID, output = work_queue.parse_reply(reply[1])
+		except ValueError:
+			print("* Dropping malformed reply: {!r}".format(reply[1][:64]))
+			continue
+		future = pending.pop(imageID, None)
+		if future is not None and not future.done():
+			future.set_result(output)
+
+@asynccontextmanager
+async def lifespan(app):
+	task = asyncio.create_task(dispatch_replies())
+	yield
+	task.cancel()
+
+async def homepage(request):
+	return PlainTextResponse("Welcome to the PyImageSearch Keras REST API!")
+
+async def metrics_endpoint(request):
+	return PlainTextResponse(metrics.REGISTRY.render(),
+		media_type=metrics.CONTENT_TYPE)
+
+async def predict(request):
+	# count the request as in flight until it is answered, and trace it
+	started = time.time()
+	tracing.IN_FLIGHT.inc()
+	try:
+		k = str(uuid.uuid4())
+		data, status, queuedAt, trace, headers = await classify_upload(
+			request, k)
+		tracing.finish(k, started, queuedAt, trace, status)
+	finally:
+		tracing.IN_FLIGHT.dec()
+	return JSONResponse(data, status_code=status,
+		headers=dict(headers, **{"X-Request-ID": k}))
+
+async def classify_upload(request, k):
+	# returns (data, HTTP status, queued_at, model server trace, extra
+	# response headers)
+	# initialize the data dictionary that will be returned from the
+	# view
+	data = {"success": False}
+
+	# ensure an image was properly uploaded to our endpoint
+	form = await request.form()
+	upload = form.get("image")
+	if upload is None or isinstance(upload, str):
+		return data, 200, None, {}, {}
+
+	# read the upload; unless the prediction cache is off, answer repeats
+	# of a recent upload from it, and let copies of an upload that is
+	# already being classified wait for that result
+	raw = await upload.read()
+	if not settings.PREDICTION_CACHE:
+		return await classify_image(request, k, raw)
+
+	return await cache.classify_async(dedup.content_key(raw),
+		lambda: classify_image(request, k, raw))
+
+async def classify_image(request, k, raw):
+	# classify the uploaded bytes `raw` through the queue; returns the same
+	# tuple as classify_upload
+	data = {"success": False}
+
+	# before spending any time on the upload, turn it away if the queue is
+	# already too long to classify it in time
+	priority = admission.is_priority(len(raw),
+		request.headers.get("X-Priority"))
+	retryAfter = await admit(priority)
+	if retryAfter is not None:
+		data["error"] = "server busy"
+		return data, settings.REJECT_STATUS, None, {}, {
+			"Retry-After": str(retryAfter)}
+
+	# read the image and prepare it for classification off the event loop
+	loop = asyncio.get_running_loop()
+	image, preprocess = await loop.run_in_executor(executor, load_image, raw)
+
+	# register the future the result will resolve, then queue the image,
+	# stamped with when it was queued
+	future = loop.create_future()
+	pending[k] = future
+	queuedAt = time.time()
+	d = helpers.encode_message(k, image, preprocessed=preprocess,
+		reply_to=replyTo, queued_at=queuedAt)
+	pipe = db.pipeline(transaction=False)
+	work_queue.push_image(pipe, d, priority)
+	await pipe.execute()
+
+	# wait (without blocking the loop) for the model server's output
+	# predictions, or give up after RESULT_TIMEOUT
+	try:
+		output = await asyncio.wait_for(future, settings.RESULT_TIMEOUT)
+	except asyncio.TimeoutError:
+		pending.pop(k, None)
+		data["error"] = "timed out waiting for the model server"
+		return data, 504, queuedAt, {}, {}
+
+	# add the output predictions to our data dictionary so we can return
+	# it to the client, and let the model server's timing refine the
+	# estimated queue wait
+	data["predictions"], trace = helpers.decode_output(output)
+	controller.observe(trace)
+
+	# indicate that the request was a success
+	data["success"] = True
+	return data, 200, queuedAt, trace, {}
+
+app = Starlette(routes=[
+	Route("/", homepage),
+	Route("/predict", predict, methods=["POST"]),
+	Route("/metrics", metrics_endpoint),
+], lifespan=lifespan)
+
+if __name__ == "__main__":
+	print("* Starting async web service...")
+	uvicorn.run(app, host="127.0.0.1", port=5000)
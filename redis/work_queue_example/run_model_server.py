@@ -1,22 +1,160 @@
 # import the necessary packages
 from tensorflow.keras.applications import ResNet50
+import tensorflow as tf
 from keras.applications import imagenet_utils
-import numpy as np
 import settings
 import helpers
-import redis
+import transports
+import batching
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty, Full
+import threading
+import argparse
 import time
-import json
 
 import os
 
 os.environ['KMP_DUPLICATE_LIB_OK']='True'
 
-# connect to Redis server
-db = redis.StrictRedis(host=settings.REDIS_HOST,
-	port=settings.REDIS_PORT, password=settings.REDIS_PASSWORD, db=settings.REDIS_DB)
+# The server runs as three stages connected by bounded queues, so the CPU
+# never waits on Redis and the model never waits on decoding:
+#
+#   fetch thread:   claim batch N+1 from the queue and decode it into a free
+#                   batch buffer (rows decoded in parallel by a small pool)
+#   main thread:    model.predict on batch N
+#   writer thread:  decode_predictions for batch N-1, publish its results
+#                   and acknowledge it
+#
+# A pool of PIPELINE_DEPTH + 1 preallocated buffers caps how far the fetch
+# stage can run ahead (it takes a buffer before claiming, so a worker never
+# holds more than PIPELINE_DEPTH claimed batches that predict hasn't
+# started); a buffer goes back to the pool as soon as predict is done with
+# it. Batches pass through every stage in claim order, so acks
+# (which trim the oldest claimed items) stay correct.
+
+# model server metrics, served on MODEL_METRICS_PORT
+QUEUE_DEPTH = metrics.Gauge("model_queue_depth",
+	"Images waiting in the queue after the last batch was claimed")
+TARGET_BATCH_SIZE = metrics.Gauge("model_target_batch_size",
+	"Batch size the dynamic batcher is currently aiming for")
+IMAGES = metrics.Counter("model_images_total", "Images classified")
+BATCH_SIZES = metrics.Histogram("model_batch_size", "Images per batch",
+	buckets=batching.size_buckets(settings.BATCH_SIZE))
+QUEUE_WAIT_SECONDS = metrics.Histogram("model_queue_wait_seconds",
+	"Time from an image being queued to its batch being claimed")
+BATCH_WAIT_SECONDS = metrics.Histogram("model_batch_wait_seconds",
+	"Time a batch was held open waiting for more images")
+DECODE_SECONDS = metrics.Histogram("model_decode_seconds",
+	"Time to decode a batch into the batch buffer")
+INFERENCE_SECONDS = metrics.Histogram("model_inference_seconds",
+	"model.predict time per batch")
+PUBLISH_SECONDS = metrics.Histogram("model_publish_seconds",
+	"Time to decode predictions and publish a batch's results")
+
+def run_stage(target, *args):
+	# run a stage on a daemon thread; the main loop checks that it's alive
+	t = threading.Thread(target=target, args=args, daemon=True)
+	t.start()
+	return t
+
+def check_stages(stages):
+	# a dead stage would leave the others blocked forever, so the process
+	# exits instead (a supervisor restart then requeues its claimed images)
+	if not all(t.is_alive() for t in stages):
+		raise RuntimeError("a model server pipeline stage died")
+
+def put_checked(q, item, stages):
+	# q.put on a bounded queue that re-checks the stages while it is full
+	while True:
+		try:
+			q.put(item, timeout=settings.QUEUE_BLOCK_TIMEOUT)
+			return
+		except Full:
+			check_stages(stages)
+
+def get_checked(q, stages):
+	# q.get that re-checks the stages while the queue is empty
+	while True:
+		try:
+			return q.get(timeout=settings.QUEUE_BLOCK_TIMEOUT)
+		except Empty:
+			check_stages(stages)
+
+def fetch_stage(batcher, freeBuffers, ready, pool):
+	# runs until the main (predict) thread is gone
+	main = [threading.main_thread()]
+	while True:
+		# wait for a free batch buffer before claiming anything, so images
+		# stay on the shared queue (where other workers and the queue depth
+		# see them) until this worker can actually decode them
+		batchBuffer = get_checked(freeBuffers, main)
+
+		# block until there is at least one image, then keep claiming
+		# until the batch is full or the max batching delay has passed
+		queue = []
+		while not queue:
+			queue, waited = batcher.next_batch()
+		claimedAt = time.time()
+		BATCH_WAIT_SECONDS.observe(waited)
+		QUEUE_DEPTH.set(batcher.queue_depth)
+
+		# decode the claimed images straight into the batch buffer;
+		# `batch` is a view of just the rows that were filled
+		start = time.perf_counter()
+		headers, batch = helpers.assemble_batch(queue, batchBuffer, pool)
+		DECODE_SECONDS.observe(time.perf_counter() - start)
+		for header in headers:
+			if "queued_at" in header:
+				QUEUE_WAIT_SECONDS.observe(claimedAt - header["queued_at"])
+		put_checked(ready, (headers, batch, batchBuffer, claimedAt), main)
+
+def write_stage(wq, done):
+	while True:
+		headers, preds, trace = done.get()
+		start = time.perf_counter()
+		results = imagenet_utils.decode_predictions(preds)
+
+		# loop over the image headers and their corresponding set of
+		# results from our model
+		outputs = []
+		for (header, resultSet) in zip(headers, results):
+			# initialize the list of output predictions
+			output = []
+
+			# loop over the results and add them to the list of
+			# output predictions
+			for (imagenetID, label, prob) in resultSet:
+				r = {"label": label, "probability": float(prob)}
+				output.append(r)
+
+			outputs.append((header["id"], helpers.encode_output(output, trace),
+				header.get("reply_to")))
+
+		# push each image's predictions to its reply list (waking up
+		# the waiting request) and
+		# acknowledge the batch, all in a single round-trip
+		wq.publish_batch(outputs)
+		PUBLISH_SECONDS.observe(time.perf_counter() - start)
+
+def configure_threads(intra_op=settings.TF_INTRA_OP_THREADS,
+	inter_op=settings.TF_INTER_OP_THREADS):
+	# cap TensorFlow's thread pools (0 keeps TF's default of one thread per
+	# core); has to happen before the model is loaded
+	if intra_op:
+		tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+	if inter_op:
+		tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+def classify_process(worker_id=None, report=None):
+	# `worker_id` names this worker's processing list (default
+	# MODEL_WORKER_ID, else host:pid);
+	# `report`, if given, is called with the batching metrics instead of
+	# printing them
+	configure_threads()
+	if settings.MODEL_METRICS_PORT:
+		metrics.serve(settings.MODEL_METRICS_PORT)
 
-def classify_process():
 	# load the pre-trained Keras model (here we are using a model
 	# pre-trained on ImageNet and provided by Keras, but you can
 	# substitute in your own networks just as easily)
@@ -24,64 +162,83 @@ def classify_process():
 	model = ResNet50(weights="imagenet")
 	print("* Model loaded")
 
-	# continually pool for new images to classify
+	# claim images through a per-worker processing list so several model
+	# servers can share one queue (or from shared memory, with the "shm"
+	# transport); anything this worker, or a dead worker on this host,
+	# claimed before a crash goes back on the queue first
+	wq = transports.open_model_transport(worker_id)
+	requeued = wq.requeue_abandoned()
+	if requeued:
+		print("* Requeued {} abandoned images".format(requeued))
+
+	# allocate the batch buffers once and reuse them for every batch
+	# instead of growing a new array with np.vstack per image
+	freeBuffers = Queue()
+	for i in range(settings.PIPELINE_DEPTH + 1):
+		freeBuffers.put(helpers.new_batch_buffer(settings.BATCH_SIZE))
+
+	# the batcher decides how many images to collect and for how long,
+	# adapting the batch size to how fast the model actually is
+	batcher = batching.DynamicBatcher(wq,
+		adaptive=settings.ADAPTIVE_BATCHING)
+	lastLog = time.monotonic()
+
+	# start the fetch and writer stages around the predict loop
+	ready = Queue(maxsize=settings.PIPELINE_DEPTH)
+	done = Queue(maxsize=settings.PIPELINE_DEPTH)
+	pool = ThreadPoolExecutor(settings.DECODE_THREADS) \
+		if settings.DECODE_THREADS > 1 else None
+	stages = [run_stage(fetch_stage, batcher, freeBuffers, ready, pool),
+		run_stage(write_stage, wq, done)]
+
+	# continually wait for decoded batches to classify
 	while True:
-		# attempt to grab a batch of images from the database, then
-		# initialize the image IDs and batch of images themselves
-		queue = db.lrange(settings.IMAGE_QUEUE, 0, settings.BATCH_SIZE - 1)
-		imageIDs = []
-		batch = None
-
-		# loop over the queue
-		for q in queue:
-			# deserialize the object and obtain the input image
-			q = json.loads(q.decode("utf-8"))
-			image = helpers.base64_decode_image(q["image"],
-				settings.IMAGE_DTYPE,
-				(1, settings.IMAGE_HEIGHT, settings.IMAGE_WIDTH,
-					settings.IMAGE_CHANS))
-
-			# check to see if the batch list is None
-			if batch is None:
-				batch = image
-
-			# otherwise, stack the data
-			else:
-				batch = np.vstack([batch, image])
+		check_stages(stages)
 
-			# update the list of image IDs
-			imageIDs.append(q["id"])
+		try:
+			headers, batch, batchBuffer, claimedAt = ready.get(
+				timeout=settings.QUEUE_BLOCK_TIMEOUT)
+		except Empty:
+			headers = []
 
 		# check to see if we need to process the batch
-		if len(imageIDs) > 0:
-			# classify the batch
-			print("* Batch size: {}".format(batch.shape))
+		if len(headers) > 0:
+			# classify the batch, timing it for the batcher, then hand
+			# the buffer back to the fetch stage and the predictions to
+			# the writer
+			predictStart = time.time()
+			start = time.perf_counter()
 			preds = model.predict(batch)
-			results = imagenet_utils.decode_predictions(preds)
-
-			# loop over the image IDs and their corresponding set of
-			# results from our model
-			for (imageID, resultSet) in zip(imageIDs, results):
-				# initialize the list of output predictions
-				output = []
-
-				# loop over the results and add them to the list of
-				# output predictions
-				for (imagenetID, label, prob) in resultSet:
-					r = {"label": label, "probability": float(prob)}
-					output.append(r)
-
-				# store the output predictions in the database, using
-				# the image ID as the key so we can fetch the results
-				db.set(imageID, json.dumps(output))
-
-			# remove the set of images from our queue
-			db.ltrim(settings.IMAGE_QUEUE, len(imageIDs), -1)
-
-		# sleep for a small amount
-		time.sleep(settings.SERVER_SLEEP)
+			seconds = time.perf_counter() - start
+			batcher.record(len(headers), seconds)
+			freeBuffers.put(batchBuffer)
+
+			INFERENCE_SECONDS.observe(seconds)
+			BATCH_SIZES.observe(len(headers))
+			IMAGES.inc(len(headers))
+			TARGET_BATCH_SIZE.set(batcher.target)
+
+			# the trace every image of the batch is answered with
+			trace = {"worker": wq.worker_id, "batch_size": len(headers),
+				"claimed_at": claimedAt, "predict_start": predictStart,
+				"predict_end": predictStart + seconds}
+			put_checked(done, (headers, preds, trace), stages)
+
+		# periodically report queue depth, batch sizes and wait vs
+		# compute time
+		if time.monotonic() - lastLog >= settings.METRICS_LOG_INTERVAL:
+			if report is None:
+				print("* Batching: {}".format(batcher.metrics()))
+			else:
+				report(batcher.metrics())
+			lastLog = time.monotonic()
 
 # if this is the main thread of execution start the model server
 # process
 if __name__ == "__main__":
-	classify_process()
+	ap = argparse.ArgumentParser()
+	ap.add_argument("--worker-id", default=os.environ.get("MODEL_WORKER_ID"),
+		help="stable name for this worker's processing list, so a restart "
+		"requeues what it had claimed (default: MODEL_WORKER_ID, else host:pid)")
+	args = ap.parse_args()
+	classify_process(args.worker_id)
@@ -1,96 +1,128 @@
 # import the necessary packages
-#from keras.preprocessing.image import img_to_array
-from tensorflow.keras.preprocessing.image import img_to_array
-from keras.applications import imagenet_utils
 from PIL import Image
-import numpy as np
 import settings
 import helpers
+import transports
+import admission
+import dedup
+import tracing
+import metrics
 import flask
-import redis
 import uuid
 import time
-import json
 import io
 
-# initialize our Flask application and Redis server
+# initialize our Flask application and the transport (Redis, or shared
+# memory when the model server runs on this host) images are queued on
 app = flask.Flask(__name__)
-db = redis.StrictRedis(host=settings.REDIS_HOST,
-	port=settings.REDIS_PORT, password=settings.REDIS_PASSWORD, db=settings.REDIS_DB)
-
-def prepare_image(image, target):
-	# if the image mode is not RGB, convert it
-	if image.mode != "RGB":
-		image = image.convert("RGB")
-
-	# resize the input image and preprocess it
-	image = image.resize(target)
-	image = img_to_array(image)
-	image = np.expand_dims(image, axis=0)
-	image = imagenet_utils.preprocess_input(image)
-
-	# return the processed image
-	return image
+transport = transports.open_web_transport()
+controller = admission.AdmissionController()
+cache = dedup.PredictionCache()
 
 @app.route("/")
 def homepage():
 	return "Welcome to the PyImageSearch Keras REST API!"
 
+@app.route("/metrics")
+def metrics_endpoint():
+	return flask.Response(metrics.REGISTRY.render(),
+		mimetype=metrics.CONTENT_TYPE)
+
 @app.route("/predict", methods=["POST"])
 def predict():
+	# count the request as in flight until it is answered, and trace it
+	started = time.time()
+	tracing.IN_FLIGHT.inc()
+	try:
+		k = str(uuid.uuid4())
+		data, status, queuedAt, trace, headers = classify_upload(k)
+		tracing.finish(k, started, queuedAt, trace, status)
+	finally:
+		tracing.IN_FLIGHT.dec()
+
+	# return the data dictionary as a JSON response
+	response = flask.jsonify(data)
+	response.status_code = status
+	response.headers.update(headers)
+	response.headers["X-Request-ID"] = k
+	return response
+
+def admit(priority):
+	# None if the image may be queued, else the Retry-After seconds
+	if not settings.ADMISSION_CONTROL:
+		return None
+	if controller.stale():
+		controller.update_depths(transport.depths())
+	return controller.admit(priority)
+
+def classify_upload(k):
+	# returns (data, HTTP status, queued_at, model server trace, extra
+	# response headers)
 	# initialize the data dictionary that will be returned from the
 	# view
 	data = {"success": False}
 
 	# ensure an image was properly uploaded to our endpoint
-	if flask.request.method == "POST":
-		if flask.request.files.get("image"):
-			# read the image in PIL format and prepare it for
-			# classification
-			image = flask.request.files["image"].read()
-			image = Image.open(io.BytesIO(image))
-			image = prepare_image(image,
-				(settings.IMAGE_WIDTH, settings.IMAGE_HEIGHT))
-
-			# ensure our NumPy array is C-contiguous as well,
-			# otherwise we won't be able to serialize it
-			image = image.copy(order="C")
-
-			# generate an ID for the classification then add the
-			# classification ID + image to the queue
-			k = str(uuid.uuid4())
-			image = helpers.base64_encode_image(image)
-			d = {"id": k, "image": image}
-			db.rpush(settings.IMAGE_QUEUE, json.dumps(d))
-
-			# keep looping until our model server returns the output
-			# predictions
-			while True:
-				# attempt to grab the output predictions
-				output = db.get(k)
-
-				# check to see if our model has classified the input
-				# image
-				if output is not None:
-					# add the output predictions to our data
-					# dictionary so we can return it to the client
-					output = output.decode("utf-8")
-					data["predictions"] = json.loads(output)
-
-					# delete the result from the database and break
-					# from the polling loop
-					db.delete(k)
-					break
-
-				# sleep for a small amount to give the model a chance
-				# to classify the input image
-				time.sleep(settings.CLIENT_SLEEP)
-
-			# indicate that the request was a success
-			data["success"] = True
+	if not flask.request.files.get("image"):
+		return data, 200, None, {}, {}
+
+	# read the upload; unless the prediction cache is off, answer repeats
+	# of a recent upload from it, and let copies of an upload that is
+	# already being classified wait for that result
+	image = flask.request.files["image"].read()
+	if not settings.PREDICTION_CACHE:
+		return classify_image(k, image)
+
+	return cache.classify(dedup.content_key(image),
+		lambda: classify_image(k, image))
+
+def classify_image(k, image):
+	# classify the uploaded bytes `image` through the queue; returns the
+	# same tuple as classify_upload
+	data = {"success": False}
 
-	# return the data dictionary as a JSON response
-	return flask.jsonify(data)
+	# before spending any time on the upload, turn it away if the queue is
+	# already too long to classify it in time
+	priority = admission.is_priority(len(image),
+		flask.request.headers.get("X-Priority"))
+	retryAfter = admit(priority)
+	if retryAfter is not None:
+		data["error"] = "server busy"
+		return data, settings.REJECT_STATUS, None, {}, {
+			"Retry-After": str(retryAfter)}
+
+	# read the image in PIL format and prepare it for
+	# classification
+	image = Image.open(io.BytesIO(image))
+	preprocess = settings.IMAGE_WIRE_DTYPE != "uint8"
+	image = helpers.prepare_image(image,
+		(settings.IMAGE_WIDTH, settings.IMAGE_HEIGHT),
+		preprocess=preprocess)
+
+	# add the classification ID + image to the queue as a binary
+	# message, stamped with when it was queued
+	queuedAt = time.time()
+	transport.submit(k, image, priority=priority, preprocessed=preprocess,
+		queued_at=queuedAt)
+
+	# block until our model server sends back the output
+	# predictions (no polling), or give up after RESULT_TIMEOUT
+	output = transport.wait(k)
+
+	# the model server never answered, so report the error
+	if output is None:
+		data["error"] = "timed out waiting for the model server"
+		return data, 504, queuedAt, {}, {}
+
+	# add the output predictions to our data dictionary so we
+	# can return it to the client, and let the model server's timing
+	# refine the estimated queue wait
+	data["predictions"], trace = helpers.decode_output(output)
+	controller.observe(trace)
+
+	# indicate that the request was a success
+	data["success"] = True
+	return data, 200, queuedAt, trace, {}
 
 # for debugging purposes, it's helpful to start the Flask testing
 # server (don't use this for production
@@ -4,6 +4,18 @@ REDIS_PORT = 17561 # <-- likely need to change this too!
 REDIS_PASSWORD = "DFDSKLFEI some password LKDJFLSDKFJD"
 REDIS_DB = 0
 
+# connections each async web server process may open to Redis
+REDIS_MAX_CONNECTIONS = 20
+
+# how images travel between the web and model servers: "redis" (the image
+# queue above) or "shm" (shared memory, both servers on the same host;
+# no Redis needed). With "shm" the model server listens on SHM_SOCKET and
+# every web server process gets a ring of SHM_SLOTS image slots
+TRANSPORT = "redis"
+SHM_SOCKET = "/tmp/keras_rest_api.sock"
+SHM_SLOTS = 64
+SHM_AUTHKEY = b"keras-rest-api"
+
 # initialize constants used to control image spatial dimensions and
 # data type
 IMAGE_WIDTH = 224
@@ -11,8 +23,89 @@ IMAGE_HEIGHT = 224
 IMAGE_CHANS = 3
 IMAGE_DTYPE = "float32"
 
+# dtype images travel in on the queue: "uint8" sends the resized 8-bit
+# pixels (4x smaller) and the model server converts and preprocesses them;
+# "float32" sends already preprocessed floats
+IMAGE_WIRE_DTYPE = "uint8"
+
+# let PIL decode JPEG uploads at a reduced size (draft mode) before the
+# resize; much faster for large photos, but the pixels differ slightly from
+# a full-size decode
+JPEG_DRAFT = True
+
 # initialize constants used for server queuing
 IMAGE_QUEUE = "image_queue"
 BATCH_SIZE = 32
-SERVER_SLEEP = 0.25
-CLIENT_SLEEP = 0.25
+
+# priority lane: uploads up to PRIORITY_MAX_BYTES, or sent with an
+# "X-Priority: interactive" header, go on PRIORITY_QUEUE, which model
+# servers always claim first. Turn it on for web and model servers together
+PRIORITY_LANE = False
+PRIORITY_QUEUE = "image_queue:priority"
+DOORBELL_QUEUE = "image_queue:doorbell"
+PRIORITY_MAX_BYTES = 64 * 1024
+
+# admission control: /predict answers REJECT_STATUS with a Retry-After
+# header instead of queueing when MAX_QUEUE_DEPTH images are already
+# waiting, or when the estimated queue wait exceeds QUEUE_WAIT_SLO seconds.
+# The queue depth is re-read at most every ADMISSION_CHECK_INTERVAL seconds
+ADMISSION_CONTROL = True
+MAX_QUEUE_DEPTH = 256
+QUEUE_WAIT_SLO = 5.0
+ADMISSION_CHECK_INTERVAL = 0.1
+REJECT_STATUS = 503
+
+# how long the web server waits for a prediction before answering with an
+# error, and how long an unread prediction is kept (seconds)
+RESULT_TIMEOUT = 30
+RESULT_TTL = 60
+
+# prediction cache: web servers answer repeat uploads of the same bytes
+# from memory for CACHE_TTL seconds, keeping at most CACHE_MAX_BYTES of
+# predictions per process, and identical uploads that arrive while one is
+# being classified share its result
+PREDICTION_CACHE = True
+CACHE_TTL = 300
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# threads the async web server uses to decode and prepare uploads
+PREPARE_THREADS = 4
+
+# how long a model server blocks waiting for work before looping (seconds);
+# this only bounds how often the loop wakes up, not how fast work is picked up
+QUEUE_BLOCK_TIMEOUT = 5
+
+# dynamic batching: after the first image of a batch arrives, wait at most
+# MAX_BATCH_DELAY seconds for more. The target batch size adapts to measured
+# model.predict times, picking the smallest size within
+# BATCH_THROUGHPUT_SLACK of the best throughput whose batch latency fits
+# BATCH_LATENCY_BUDGET seconds
+MAX_BATCH_DELAY = 0.02
+ADAPTIVE_BATCHING = True
+BATCH_LATENCY_BUDGET = 1.0
+BATCH_THROUGHPUT_SLACK = 0.05
+
+# model server pipeline: how many decoded batches may wait for
+# model.predict (and predicted batches for the result writer), and how many
+# threads decode the images of one batch
+PIPELINE_DEPTH = 2
+DECODE_THREADS = 2
+
+# model server processes model_supervisor.py starts by default
+MODEL_WORKERS = 2
+
+# TensorFlow thread pools per model server process (0 = TF's default);
+# model_supervisor.py sets these per worker
+TF_INTRA_OP_THREADS = 0
+TF_INTER_OP_THREADS = 0
+
+# how often the model server prints its batching metrics (seconds)
+METRICS_LOG_INTERVAL = 10
+
+# port the model server serves /metrics on (0 = off); model_supervisor.py
+# gives worker i port MODEL_METRICS_PORT + i. Web servers serve /metrics on
+# their own port
+MODEL_METRICS_PORT = 9100
+
+# /predict requests slower than this are logged with a per-stage breakdown
+TRACE_SLOW_SECONDS = 2.0
@@ -0,0 +1,55 @@
+# import the necessary packages
+import settings
+import metrics
+import time
+
+# Per-request tracing for /predict. The web server stamps each queued image
+# with its request ID and "queued_at"; the model server answers with the
+# predictions plus a "trace" of when it claimed the batch and when
+# model.predict started and ended (helpers.encode_output). From those the
+# web server splits every request into stages and records each in a
+# histogram:
+#
+#   prepare    upload received -> image queued (decode, prepare_image)
+#   queue      queued -> claimed by a model server (includes batching delay)
+#   batch      claimed -> model.predict starts (decode, earlier batches)
+#   inference  model.predict
+#   reply      predict done -> reply received (decode_predictions, publish)
+#
+# queue, batch and inference compare clocks on two machines, so they are
+# only as accurate as the hosts' clock sync. Requests slower than
+# TRACE_SLOW_SECONDS are also logged with their ID and breakdown.
+
+STAGES = ["prepare", "queue", "batch", "inference", "reply"]
+
+REQUESTS = metrics.Counter("web_requests_total",
+	"Finished /predict requests by HTTP status")
+IN_FLIGHT = metrics.Gauge("web_requests_in_flight",
+	"/predict requests currently being handled")
+REQUEST_SECONDS = metrics.Histogram("web_request_seconds",
+	"End-to-end /predict latency")
+STAGE_SECONDS = {stage: metrics.Histogram("web_{}_seconds".format(stage),
+	"Time /predict requests spend in the {} stage".format(stage))
+	for stage in STAGES}
+
+def finish(request_id, started, queued_at, trace, status):
+	# record one finished request; times are time.time() values
+	now = time.time()
+	REQUESTS.inc(status=status)
+	REQUEST_SECONDS.observe(now - started)
+
+	spans = {}
+	if queued_at is not None:
+		spans["prepare"] = queued_at - started
+	if trace:
+		spans["queue"] = trace["claimed_at"] - queued_at
+		spans["batch"] = trace["predict_start"] - trace["claimed_at"]
+		spans["inference"] = trace["predict_end"] - trace["predict_start"]
+		spans["reply"] = now - trace["predict_end"]
+	for (stage, seconds) in spans.items():
+		STAGE_SECONDS[stage].observe(max(0.0, seconds))
+
+	if now - started >= settings.TRACE_SLOW_SECONDS:
+		print("[trace] {} status {} {:.0f} ms: {}".format(request_id, status,
+			1000 * (now - started), " ".join("{} {:.0f} ms".format(stage,
+			1000 * seconds) for (stage, seconds) in spans.items())))
@@ -0,0 +1,281 @@
+# import the necessary packages
+from multiprocessing.connection import Listener, Client
+from multiprocessing import shared_memory, resource_tracker
+from collections import deque
+from queue import Queue, Empty
+import numpy as np
+import threading
+import settings
+import helpers
+import work_queue
+import atexit
+import redis
+import os
+
+# How images get from the web server to the model server and predictions
+# get back, selected by settings.TRANSPORT.
+#
+# Web side (run_web_server.py):
+#   submit(image_id, image, priority, **meta)  queue one image
+#   wait(image_id, timeout)          its predictions as JSON text, or None
+#   depths()                         (images ahead of a priority image,
+#                                    images ahead of a normal one)
+#
+# Model side (run_model_server.py; also what batching.DynamicBatcher needs):
+#   claim_batch(max_items, timeout)  raw messages, blocking for the first
+#   depth()                          images waiting to be claimed
+#   publish_batch(results)           (image_id, output, reply_to) for the
+#                                    oldest claimed batch, in claim order
+#   requeue_abandoned()              recover work lost by a crash of this
+#                                    worker (or of dead workers on this host)
+#
+# "redis" is the Redis work queue (work_queue.py). "shm" is for a web
+# server and model server on the same host: each web server process
+# writes images into its own shared memory ring of SHM_SLOTS slots, and
+# only slot numbers and predictions travel over a Unix socket to the model
+# server, which decodes straight out of shared memory. No Redis is needed.
+
+def redis_connection():
+	return redis.StrictRedis(host=settings.REDIS_HOST,
+		port=settings.REDIS_PORT, password=settings.REDIS_PASSWORD,
+		db=settings.REDIS_DB)
+
+def open_web_transport():
+	if settings.TRANSPORT == "shm":
+		return ShmWebTransport()
+	return RedisWebTransport(redis_connection())
+
+def open_model_transport(worker_id=None):
+	if settings.TRANSPORT == "shm":
+		return ShmModelTransport()
+	if settings.PRIORITY_LANE:
+		return RedisModelTransport(redis_connection(), worker_id,
+			priority_queue=settings.PRIORITY_QUEUE,
+			doorbell=settings.DOORBELL_QUEUE)
+	return RedisModelTransport(redis_connection(), worker_id)
+
+class RedisWebTransport:
+	def __init__(self, db):
+		self.db = db
+
+	def submit(self, image_id, image, priority=False, **meta):
+		pipe = self.db.pipeline(transaction=False)
+		work_queue.push_image(pipe,
+			helpers.encode_message(image_id, image, **meta), priority)
+		pipe.execute()
+
+	def depths(self):
+		pipe = self.db.pipeline(transaction=False)
+		work_queue.read_depths(pipe)
+		return work_queue.queue_depths(pipe.execute())
+
+	def wait(self, image_id, timeout=settings.RESULT_TIMEOUT):
+		output = work_queue.wait_for_result(self.db, image_id, timeout)
+		return None if output is None else output.decode("utf-8")
+
+class RedisModelTransport(work_queue.WorkQueue):
+	def publish_batch(self, results, ttl=settings.RESULT_TTL):
+		work_queue.publish_batch(self, results, ttl)
+
+# names of the shared memory rings this process created (and will unlink)
+createdHere = set()
+
+def slot_size():
+	# room for the largest message: a float32 image plus its header
+	return 1024 + settings.IMAGE_HEIGHT * settings.IMAGE_WIDTH * \
+		settings.IMAGE_CHANS * np.dtype("float32").itemsize
+
+class ShmWebTransport:
+	def __init__(self, address=settings.SHM_SOCKET, slots=settings.SHM_SLOTS):
+		self.address = address
+		self.slotSize = slot_size()
+		self.shm = shared_memory.SharedMemory(create=True,
+			size=slots * self.slotSize)
+		createdHere.add(self.shm.name)
+		atexit.register(self.shm.unlink)
+
+		self.slots = slots
+		self.free = Queue()
+		for slot in range(slots):
+			self.free.put(slot)
+
+		# image_id -> [slot, threading.Event, output, gave up waiting]
+		self.waiting = {}
+		self.lock = threading.Lock()
+		self.sendLock = threading.Lock()
+		self.conn = None
+
+	def connect(self):
+		# (re)connect to the model server and tell it where our ring is;
+		# caller holds self.lock
+		if self.conn is None:
+			self.conn = Client(self.address, family="AF_UNIX",
+				authkey=settings.SHM_AUTHKEY)
+			self.conn.send(("hello", self.shm.name, self.slotSize))
+			threading.Thread(target=self.read_replies, args=(self.conn,),
+				daemon=True).start()
+		return self.conn
+
+	def depths(self):
+		# this process's images that are queued or being classified (there
+		# is no priority lane)
+		inFlight = self.slots - self.free.qsize()
+		return inFlight, inFlight
+
+	def submit(self, image_id, image, priority=False, **meta):
+		# a full ring means the model server is far behind: wait for a
+		# slot rather than queueing without bound
+		try:
+			slot = self.free.get(timeout=settings.RESULT_TIMEOUT)
+		except Empty:
+			raise RuntimeError("no free shared memory slot")
+
+		start = slot * self.slotSize
+		size = helpers.encode_message_into(
+			self.shm.buf[start:start + self.slotSize], image_id, image, **meta)
+
+		with self.lock:
+			try:
+				conn = self.connect()
+			except OSError:
+				self.free.put(slot)
+				raise
+			self.waiting[image_id] = [slot, threading.Event(), None, False]
+
+		try:
+			with self.sendLock:
+				conn.send(("image", slot, size))
+		except OSError:
+			# unless read_replies already released everything
+			with self.lock:
+				if self.waiting.pop(image_id, None) is not None:
+					self.free.put(slot)
+			raise
+
+	def wait(self, image_id, timeout=settings.RESULT_TIMEOUT):
+		with self.lock:
+			waiter = self.waiting.get(image_id)
+		if waiter is None:
+			return None
+		waiter[1].wait(timeout)
+		with self.lock:
+			# a timed out request keeps its slot until the model server
+			# answers, since it may still be reading the image
+			if waiter[2] is None and not waiter[1].is_set():
+				waiter[3] = True
+			else:
+				self.waiting.pop(image_id, None)
+		return waiter[2]
+
+	def read_replies(self, conn):
+		try:
+			while True:
+				(kind, slot, image_id, output) = conn.recv()
+				with self.lock:
+					waiter = self.waiting.get(image_id)
+					if waiter is not None:
+						waiter[2] = output
+						if waiter[3]:
+							del self.waiting[image_id]
+				self.free.put(slot)
+				if waiter is not None:
+					waiter[1].set()
+		except (EOFError, OSError):
+			pass
+
+		# the model server went away: release every slot and wake up
+		# everyone still waiting (they see a timeout)
+		with self.lock:
+			if self.conn is conn:
+				self.conn = None
+			waiting, self.waiting = self.waiting, {}
+		for (slot, event, output, gaveUp) in waiting.values():
+			self.free.put(slot)
+			event.set()
+
+class ShmPeer:
+	# model server side of one connected web server process
+	def __init__(self, conn, name, slotSize):
+		self.conn = conn
+		self.slotSize = slotSize
+		self.sendLock = threading.Lock()
+		self.shm = shared_memory.SharedMemory(name=name)
+
+		# attaching registers the segment with this process's resource
+		# tracker, which would unlink it when we exit; the web server
+		# owns it (unless both run in this process, e.g. load_test.py)
+		if name not in createdHere:
+			resource_tracker.unregister(self.shm._name, "shared_memory")
+
+	def view(self, slot, size):
+		start = slot * self.slotSize
+		return self.shm.buf[start:start + size]
+
+	def send(self, message):
+		try:
+			with self.sendLock:
+				self.conn.send(message)
+		except OSError:
+			# the web server is gone; nobody is waiting for this
+			pass
+
+class ShmModelTransport:
+	def __init__(self, address=settings.SHM_SOCKET):
+		if os.path.exists(address):
+			os.unlink(address)
+		self.listener = Listener(address, family="AF_UNIX",
+			authkey=settings.SHM_AUTHKEY)
+		self.worker_id = work_queue.process_id()
+		self.ready = Queue()
+		self.claimed = deque()
+		self.lock = threading.Lock()
+		threading.Thread(target=self.accept, daemon=True).start()
+
+	def accept(self):
+		while True:
+			conn = self.listener.accept()
+			threading.Thread(target=self.read_images, args=(conn,),
+				daemon=True).start()
+
+	def read_images(self, conn):
+		try:
+			(kind, name, slotSize) = conn.recv()
+			peer = ShmPeer(conn, name, slotSize)
+			while True:
+				(kind, slot, size) = conn.recv()
+				self.ready.put((peer, slot, size))
+		except (EOFError, OSError):
+			conn.close()
+
+	def claim_batch(self, max_items, timeout):
+		# block for up to `timeout` seconds for the first image, then take
+		# whatever else is already waiting (up to max_items in total)
+		try:
+			items = [self.ready.get(timeout=timeout)]
+		except Empty:
+			return []
+		while len(items) < max_items:
+			try:
+				items.append(self.ready.get_nowait())
+			except Empty:
+				break
+
+		with self.lock:
+			self.claimed.extend(items)
+		return [peer.view(slot, size) for (peer, slot, size) in items]
+
+	def depth(self):
+		return self.ready.qsize()
+
+	def publish_batch(self, results, ttl=None):
+		# answering an image also hands its slot back to the web server
+		with self.lock:
+			items = [self.claimed.popleft() for _ in results]
+		for ((peer, slot, size), (image_id, output, reply_to)) in \
+			zip(items, results):
+			peer.send(("result", slot, image_id, output))
+
+	def requeue_abandoned(self, worker_id=None):
+		# nothing survives a restart: the web servers see the socket close
+		# and fail their waiting requests
+		return 0
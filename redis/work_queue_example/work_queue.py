@@ -0,0 +1,242 @@
+# import the necessary packages
+import settings
+import socket
+import os
+
+# Reliable batch dequeue for the image queue. A worker blocks (BLMOVE) until
+# at least one image is queued, then a Lua script moves up to a whole batch
+# more in one atomic step. Claimed items are moved onto a per-worker
+# "processing" list instead of being deleted, so two workers can never grab
+# the same image, and the images of a worker that dies mid-batch can be put
+# back on the queue by requeue_abandoned().
+
+# moves up to ARGV[1] items from the head of KEYS[1] to the tail of KEYS[2]
+# and returns them; runs atomically inside Redis
+CLAIM_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+	redis.call('LTRIM', KEYS[1], #items, -1)
+	redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+# with a priority lane: moves up to ARGV[1] items, first from the priority
+# queue KEYS[1] and then from the normal queue KEYS[2], to the tail of
+# KEYS[3], and drops one doorbell token (KEYS[4]) per item taken beyond the
+# ARGV[2] tokens the caller already popped
+CLAIM_LANES_SCRIPT = """
+local n = tonumber(ARGV[1])
+local items = redis.call('LRANGE', KEYS[1], 0, n - 1)
+if #items > 0 then
+	redis.call('LTRIM', KEYS[1], #items, -1)
+end
+if #items < n then
+	local more = redis.call('LRANGE', KEYS[2], 0, n - #items - 1)
+	if #more > 0 then
+		redis.call('LTRIM', KEYS[2], #more, -1)
+		for i = 1, #more do
+			items[#items + 1] = more[i]
+		end
+	end
+end
+if #items > 0 then
+	redis.call('RPUSH', KEYS[3], unpack(items))
+	local used = #items - tonumber(ARGV[2])
+	if used > 0 then
+		redis.call('LTRIM', KEYS[4], used, -1)
+	end
+end
+return items
+"""
+
+# moves everything on a processing list back to the head of the queue (and
+# rings the doorbell KEYS[3] once per item, if given)
+REQUEUE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+for i = #items, 1, -1 do
+	redis.call('LPUSH', KEYS[2], items[i])
+	if #KEYS > 2 then
+		redis.call('RPUSH', KEYS[3], 1)
+	end
+end
+redis.call('DEL', KEYS[1])
+return #items
+"""
+
+def process_id():
+	# host:pid, unique per process on a host and stable for the life of the
+	# process; names anything that must never be shared between processes
+	return "{}:{}".format(socket.gethostname(), os.getpid())
+
+def default_worker_id():
+	# MODEL_WORKER_ID from the environment if set, so a restarted worker
+	# finds its predecessor's processing list; otherwise process_id()
+	return os.environ.get("MODEL_WORKER_ID") or process_id()
+
+def pid_alive(pid):
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+def processing_key(worker_id, queue=settings.IMAGE_QUEUE):
+	return "{}:processing:{}".format(queue, worker_id)
+
+# With PRIORITY_LANE on, small and interactive images go on a separate
+# priority queue that is always claimed first. BLMOVE can only block on one
+# list, so web servers also push a token onto a "doorbell" list for every
+# image, and workers block on that (BLPOP) instead; the claim script drops
+# the tokens of what it took. A token can occasionally go missing in a race
+# between workers, which only delays that image until the next wake-up
+# (at most QUEUE_BLOCK_TIMEOUT).
+
+def lanes(priority):
+	# (queue, doorbell) to push an image onto
+	if not settings.PRIORITY_LANE:
+		return settings.IMAGE_QUEUE, None
+	queue = settings.PRIORITY_QUEUE if priority else settings.IMAGE_QUEUE
+	return queue, settings.DOORBELL_QUEUE
+
+def push_image(pipe, message, priority=False):
+	# queue an encoded image on its lane onto the (sync or asyncio)
+	# pipeline `pipe`; the caller executes it
+	queue, doorbell = lanes(priority)
+	pipe.rpush(queue, message)
+	if doorbell:
+		pipe.rpush(doorbell, 1)
+
+def read_depths(pipe):
+	# queue the LLENs that queue_depths() needs onto `pipe`
+	pipe.llen(settings.IMAGE_QUEUE)
+	if settings.PRIORITY_LANE:
+		pipe.llen(settings.PRIORITY_QUEUE)
+
+def queue_depths(lengths):
+	# (images ahead of a priority image, images ahead of a normal one) from
+	# the results of read_depths()
+	lengths = list(lengths) + [0]
+	return lengths[1], lengths[0] + lengths[1]
+
+class WorkQueue:
+	def __init__(self, db, worker_id=None, queue=settings.IMAGE_QUEUE,
+		priority_queue=None, doorbell=None):
+		self.db = db
+		self.queue = queue
+		self.priority_queue = priority_queue
+		self.doorbell = doorbell
+		self.worker_id = worker_id or default_worker_id()
+		self.processing = processing_key(self.worker_id, queue)
+		self.claim_script = db.register_script(CLAIM_SCRIPT)
+		self.claim_lanes_script = db.register_script(CLAIM_LANES_SCRIPT)
+		self.requeue_script = db.register_script(REQUEUE_SCRIPT)
+
+	def claim_lanes(self, max_items, tokens=0):
+		return self.claim_lanes_script(keys=[self.priority_queue, self.queue,
+			self.processing, self.doorbell], args=[max_items, tokens])
+
+	def claim_batch(self, max_items, timeout):
+		# block for up to `timeout` seconds for the first item, then grab
+		# whatever else is already waiting (up to max_items in total)
+		if self.priority_queue:
+			batch = self.claim_lanes(max_items)
+			if not batch:
+				rang = self.db.blpop(self.doorbell, timeout=timeout)
+				batch = self.claim_lanes(max_items, int(rang is not None))
+			return batch
+
+		first = self.db.blmove(self.queue, self.processing, timeout,
+			"LEFT", "RIGHT")
+		if first is None:
+			return []
+
+		batch = [first]
+		if max_items > 1:
+			batch.extend(self.claim_script(keys=[self.queue, self.processing],
+				args=[max_items - 1]))
+		return batch
+
+	def depth(self):
+		# number of images waiting to be claimed
+		if self.priority_queue:
+			return self.db.llen(self.queue) + self.db.llen(self.priority_queue)
+		return self.db.llen(self.queue)
+
+	def ack(self, count, pipe=None):
+		# drop the `count` oldest claimed items; batches are acknowledged in
+		# the order they were claimed
+		(pipe or self.db).ltrim(self.processing, count, -1)
+
+	def requeue_abandoned(self, worker_id=None):
+		# put a (possibly dead) worker's claimed items back on the queue;
+		# without `worker_id`, this worker's own items plus those of dead
+		# host:pid workers on this host
+		if worker_id is not None:
+			return self.requeue_worker(worker_id)
+		count = self.requeue_worker(self.worker_id)
+		for deadID in self.dead_local_workers():
+			count += self.requeue_worker(deadID)
+		return count
+
+	def requeue_worker(self, worker_id):
+		key = processing_key(worker_id, self.queue)
+		keys = [key, self.queue] + ([self.doorbell] if self.doorbell else [])
+		return self.requeue_script(keys=keys)
+
+	def dead_local_workers(self):
+		# host:pid worker IDs on this host whose process is gone; a restarted
+		# standalone server gets a new pid, so nothing else would ever
+		# reclaim their processing lists (hosts must have distinct names)
+		host = socket.gethostname()
+		prefix = processing_key(host + ":", self.queue)
+		for key in self.db.scan_iter(match=prefix + "*"):
+			pid = key.decode("utf-8")[len(prefix):]
+			if pid.isdigit() and int(pid) != os.getpid() and \
+				not pid_alive(int(pid)):
+				yield "{}:{}".format(host, pid)
+
+# Results travel back on a one-element list named after the image ID. The web
+# server BLPOPs that key, so it wakes up the moment the model server pushes
+# the predictions instead of polling GET. Unread results expire after
+# RESULT_TTL seconds, so a client that gave up doesn't leak memory.
+
+def publish_result(db, image_id, output, ttl=settings.RESULT_TTL):
+	# `db` may also be a pipeline, in which case nothing is sent yet
+	db.rpush(image_id, output)
+	db.expire(image_id, ttl)
+
+# A web server that waits on many requests at once (run_async_web_server.py)
+# puts a "reply_to" list in the message header instead. Its replies are
+# "<image_id> <output>" entries on that one shared list, so a single BLPOP
+# loop can serve every request in flight.
+
+def publish_reply(db, reply_to, image_id, output, ttl=settings.RESULT_TTL):
+	db.rpush(reply_to, "{} {}".format(image_id, output))
+	db.expire(reply_to, ttl)
+
+def parse_reply(reply):
+	# split a reply-list entry back into (image_id, output)
+	image_id, output = reply.split(b" ", 1)
+	return image_id.decode("utf-8"), output
+
+def publish_batch(wq, results, ttl=settings.RESULT_TTL):
+	# push every (image_id, output, reply_to) of a batch, set their
+	# expiries and acknowledge the batch in one MULTI/EXEC transaction: one
+	# round-trip per batch instead of several per image, and results are
+	# never visible without the batch also leaving the processing list
+	pipe = wq.db.pipeline(transaction=True)
+	for (image_id, output, reply_to) in results:
+		if reply_to:
+			publish_reply(pipe, reply_to, image_id, output, ttl)
+		else:
+			publish_result(pipe, image_id, output, ttl)
+	wq.ack(len(results), pipe)
+	pipe.execute()
+
+def wait_for_result(db, image_id, timeout=settings.RESULT_TIMEOUT):
+	# returns the raw result, or None if nothing arrived within `timeout`
+	reply = db.blpop(image_id, timeout=timeout)
+	return None if reply is None else reply[1]